@@ -7,6 +7,7 @@
     "del_folder",
     "get_cache_root",
     "get_config_root",
+    "get_data_root",
     "get_project_root",
     "list_files",
     "safe_list_get",
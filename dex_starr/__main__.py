@@ -1,5 +1,9 @@
 from argparse import ArgumentParser, Namespace
-from typing import Dict, List, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import copy
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 from pydantic import ValidationError
 from rich import box
@@ -17,19 +21,30 @@
     setup_logging,
 )
 from dex_starr.archive import Archive
-from dex_starr.console import CONSOLE
+from dex_starr.compression import CompressionPolicy
+from dex_starr.console import CONSOLE, pop_undecided, silenced
+from dex_starr.filename_parser import FilenameParser
 from dex_starr.models.comic_info.schema import ComicInfo
-from dex_starr.models.metadata.schema import Metadata
+from dex_starr.models.metadata.schema import Metadata, SeriesIdentity
 from dex_starr.models.metron_info.schema import MetronInfo
 from dex_starr.models.utils import create_metadata, to_comic_info, to_metron_info
+from dex_starr.pipeline import ImportPipeline
+from dex_starr.review_queue import ReviewQueue
+from dex_starr.services.circuit_breaker import CircuitBreaker, ServiceUnavailable
 from dex_starr.services.comicvine import SimyanTalker
+from dex_starr.services.id_index import IdIndex
+from dex_starr.services.issue_prefetch import IssuePrefetch
 from dex_starr.services.league_of_comic_geeks import HimonTalker
 from dex_starr.services.marvel import EsakTalker
+from dex_starr.services.match_scorer import MatchScorer
 from dex_starr.services.metron import MokkariTalker
+from dex_starr.services.rate_limiter import RateLimiter
+from dex_starr.services.resolution_memo import ResolutionMemo
+from dex_starr.services.sqlite_cache import MemoryCache, SQLiteCache
 from dex_starr.settings import Settings
 
 
-def read_info_file(archive: Archive) -> Optional[Metadata]:
+def read_info_file(archive: Archive, interactive: bool = True) -> Optional[Metadata]:
     info_file = archive.extracted_folder / "Metadata.json"
     if info_file.exists():
         try:
@@ -55,6 +70,9 @@ def read_info_file(archive: Archive) -> Optional[Metadata]:
         try:
             CONSOLE.print("Parsing ComicInfo.xml", style="logging.level.debug")
             comic_info = ComicInfo.from_file(info_file)
+            # Converting asks for the publisher and series when ComicInfo.xml doesn't name them
+            if not interactive and not (comic_info.publisher and comic_info.series):
+                return None
             try:
                 return comic_info.to_metadata()
             except ValidationError as err:
@@ -66,6 +84,53 @@ def read_info_file(archive: Archive) -> Optional[Metadata]:
     return None
 
 
+SERIES_FILE = "Series.json"
+series_lock = Lock()
+
+
+def read_series_file(series_folder: Path) -> Optional[SeriesIdentity]:
+    series_file = series_folder / SERIES_FILE
+    if series_file.exists():
+        try:
+            CONSOLE.print(f"Parsing {SERIES_FILE}", style="logging.level.debug")
+            return SeriesIdentity.from_file(series_file)
+        except (OSError, KeyError, ValueError) as err:
+            CONSOLE.print(f"Unable to parse {SERIES_FILE}: {err}", style="logging.level.warning")
+    return None
+
+
+def load_series_identity(metadata: Metadata, settings: Settings):
+    # Ids from earlier imports of the series let every service skip straight to the issue
+    series_folder = (
+        settings.general.collection_folder
+        / metadata.publisher.file_name
+        / metadata.series.file_name
+    )
+    if identity := read_series_file(series_folder):
+        metadata.publisher.resources = sorted(
+            {*metadata.publisher.resources, *identity.publisher.resources}
+        )
+        metadata.series.resources = sorted({*metadata.series.resources, *identity.series.resources})
+        if not metadata.series.start_year:
+            metadata.series.start_year = identity.series.start_year
+
+
+def write_series_file(series_folder: Path, metadata: Metadata):
+    with series_lock:
+        identity = SeriesIdentity(
+            publisher=metadata.publisher.copy(deep=True), series=metadata.series.copy(deep=True)
+        )
+        if existing := read_series_file(series_folder):
+            identity.publisher.resources = sorted(
+                {*identity.publisher.resources, *existing.publisher.resources}
+            )
+            identity.series.resources = sorted(
+                {*identity.series.resources, *existing.series.resources}
+            )
+        CONSOLE.print(f"Generating {SERIES_FILE}", style="logging.level.debug")
+        identity.to_file(series_folder / SERIES_FILE)
+
+
 def write_info_file(archive: Archive, settings: Settings, metadata: Metadata):
     if settings.general.generate_metadata_file:
         CONSOLE.print("Generating Metadata.json", style="logging.level.debug")
@@ -80,28 +145,168 @@ def write_info_file(archive: Archive, settings: Settings, metadata: Metadata):
         comic_info.to_file(archive.extracted_folder / "ComicInfo.xml")
 
 
+def get_field(metadata: Metadata, field: str) -> Any:
+    section, name = field.split(".")
+    return getattr(getattr(metadata, section), name)
+
+
 def pull_info(
     metadata: Metadata,
     services: Dict[str, Union[HimonTalker, MokkariTalker, SimyanTalker, EsakTalker]],
     resolution_order: List[str] = None,
     resolve_manually: bool = False,
-):
+    interactive: bool = True,
+) -> List[str]:
     if not resolution_order:
         resolution_order = []
-    for service in reversed(resolution_order):
-        if service not in services or not services[service]:
+    service_order = [
+        x
+        for x in reversed(resolution_order)
+        if services.get(x) and (x != "Marvel" or metadata.publisher.title.startswith("Marvel"))
+    ]
+    # A service whose fields are all covered by the services outranking it is only asked once
+    # they have been, and only when they left some of those fields empty
+    deferred = [
+        x
+        for index, x in enumerate(service_order)
+        if services[x].FIELDS
+        <= set().union(*(services[y].FIELDS for y in service_order[index + 1 :]))
+    ]
+    # Resolve everything that needs no input concurrently, the results are applied in the
+    # same order the sequential lookups would have been made in
+    with ThreadPoolExecutor(max_workers=max(len(service_order), 1)) as executor:
+        futures = {
+            x: executor.submit(services[x].resolve_metadata, metadata)
+            for x in service_order
+            if x not in deferred
+        }
+    filled: Dict[str, Set[str]] = {}
+    unresolved = []
+    for service in service_order:
+        if service in deferred:
             continue
-        if service == "Marvel" and not metadata.publisher.title.startswith("Marvel"):
+        if not pull_service(
+            service, services[service], metadata, futures[service], interactive=interactive
+        ):
+            unresolved.append(service)
+        filled[service] = {x for x in services[service].FIELDS if get_field(metadata, x)}
+    for service in reversed(deferred):
+        index = service_order.index(service)
+        covered = set().union(*(filled.get(x, set()) for x in service_order[index + 1 :]))
+        if services[service].FIELDS <= covered:
+            CONSOLE.print(
+                f"Skipping {service}, everything it provides is already filled",
+                style="logging.level.info",
+            )
             continue
-        CONSOLE.rule(f"[bold blue]Pulling from {service}[/]", style="dim blue")
-        services[service].update_metadata(metadata)
+        # Pulled into a copy so the fields filled by the services outranking it are kept
+        result = metadata.copy(deep=True)
+        if not pull_service(service, services[service], result, interactive=interactive):
+            unresolved.append(service)
+        filled[service] = {x for x in services[service].FIELDS if get_field(result, x)}
+        for field in filled[service] - covered:
+            section, name = field.split(".")
+            setattr(getattr(metadata, section), name, get_field(result, field))
+        for section in ["publisher", "series", "issue"]:
+            getattr(metadata, section).resources = sorted(
+                {
+                    *getattr(metadata, section).resources,
+                    *getattr(result, section).resources,
+                }
+            )
+    return unresolved
+
+
+def speculate(
+    metadata: Metadata,
+    services: Dict[str, Union[HimonTalker, MokkariTalker, SimyanTalker, EsakTalker]],
+) -> Tuple[ThreadPoolExecutor, List[Future], List[Any]]:
+    """Start the lookups the metadata implies in the background, so they are cached by the time
+    it has been confirmed.
+
+    Lookups run silenced against a copy, through copies of the talkers whose memo, id index,
+    scorer and prefetch only write to scratch ones. Nothing they resolve is applied, and the
+    scratch entries and counts only reach the shared ones once committed by confirm_speculation.
+    """
+
+    def resolve(talker: Union[HimonTalker, MokkariTalker, SimyanTalker, EsakTalker]):
+        with silenced():
+            try:
+                talker.resolve_metadata(metadata.copy(deep=True))
+            except Exception as err:
+                CONSOLE.print(f"Speculative lookup failed: {err}", style="logging.level.debug")
+
+    executor = ThreadPoolExecutor(max_workers=max(len(services), 1))
+    futures, scratch = [], []
+    for service, talker in services.items():
+        if service != "Marvel" or metadata.publisher.title.startswith("Marvel"):
+            talker = copy(talker)
+            talker.ids = IdIndex(parent=talker.ids)
+            talker.scorer = MatchScorer(parent=talker.scorer)
+            if hasattr(talker, "memo"):
+                talker.memo = ResolutionMemo(parent=talker.memo)
+            if hasattr(talker, "prefetch"):
+                talker.prefetch = IssuePrefetch(parent=talker.prefetch)
+            scratch.append(talker)
+            futures.append(executor.submit(resolve, talker))
+    return executor, futures, scratch
+
+
+def confirm_speculation(
+    speculation: Tuple[ThreadPoolExecutor, List[Future], List[Any]], confirmed: bool
+):
+    executor, futures, scratch = speculation
+    if not confirmed:
+        for future in futures:
+            future.cancel()
+        # Discarded once the lookups still running finish, without holding up the next archive
+        Thread(target=discard_speculation, args=(executor, scratch), daemon=True).start()
+        return
+    executor.shutdown(wait=True)
+    for talker in scratch:
+        try:
+            talker.ids.commit()
+            talker.scorer.commit()
+            if hasattr(talker, "memo"):
+                talker.memo.commit()
+            if hasattr(talker, "prefetch"):
+                talker.prefetch.commit()
+        finally:
+            talker.ids.close()
+
+
+def discard_speculation(executor: ThreadPoolExecutor, scratch: List[Any]):
+    executor.shutdown(wait=True)
+    for talker in scratch:
+        talker.ids.close()
+
+
+def pull_service(
+    service: str,
+    talker: Union[HimonTalker, MokkariTalker, SimyanTalker, EsakTalker],
+    metadata: Metadata,
+    future: Optional[Future] = None,
+    interactive: bool = True,
+) -> bool:
+    CONSOLE.rule(f"[bold blue]Pulling from {service}[/]", style="dim blue")
+    try:
+        if results := future.result() if future else talker.resolve_metadata(metadata):
+            talker.apply_metadata(results, metadata)
+        elif interactive:
+            talker.update_metadata(metadata)
+        else:
+            return False
+    except ServiceUnavailable as err:
+        CONSOLE.print(f"Skipping {service}: {err}", style="logging.level.warning")
+        return False
+    return True
 
 
 def clean_cache():
     for child in get_cache_root().iterdir():
         if child.is_dir():
             del_folder(child)
-        elif child.name != "cache.sqlite":
+        elif not child.name.startswith(("cache.sqlite", "ids.sqlite")):
             child.unlink(missing_ok=True)
 
 
@@ -109,11 +314,206 @@ def parse_arguments() -> Namespace:
     parser = ArgumentParser(prog="Dex-Starr")
     parser.version = __version__
     parser.add_argument("--manual-edit", action="store_true")
+    parser.add_argument("--batch", action="store_true")
+    parser.add_argument("--review", action="store_true")
     parser.add_argument("--version", action="version")
     parser.add_argument("--debug", action="store_true")
     return parser.parse_args()
 
 
+def infer_metadata(
+    archive: Archive, settings: Settings, parser: Optional[FilenameParser], batch: bool = False
+) -> Optional[Metadata]:
+    if not parser:
+        return None if batch else create_metadata()
+    parsed = parser.parse(archive.source_file)
+    if parsed.score >= settings.general.filename_threshold:
+        CONSOLE.print(f"Inferred from filename: {parsed}", style="logging.level.info")
+        return parsed.metadata
+    CONSOLE.print(f"Unsure of filename: {parsed}", style="logging.level.debug")
+    return None if batch else create_metadata(parsed.metadata)
+
+
+def tag_archive(
+    archive: Archive,
+    settings: Settings,
+    services: Dict[str, Union[HimonTalker, MokkariTalker, SimyanTalker, EsakTalker]],
+    manual_edit: bool = False,
+    queue: Optional[ReviewQueue] = None,
+    batch: bool = False,
+    metadata: Optional[Metadata] = None,
+    parser: Optional[FilenameParser] = None,
+) -> Optional[Metadata]:
+    if not metadata:
+        metadata = read_info_file(archive, interactive=not batch)
+    if metadata and not batch:
+        speculation = speculate(metadata, services)
+        CONSOLE.print(
+            Panel.fit(
+                Syntax(
+                    metadata.json(indent=2, ensure_ascii=False),
+                    "json",
+                    indent_guides=True,
+                    theme="ansi_dark",
+                    word_wrap=True,
+                ),
+                box=box.SQUARE,
+                border_style="syntax.border",
+            ),
+        )
+        confirmed = Confirm.ask("Keep Metadata", console=CONSOLE)
+        confirm_speculation(speculation, confirmed)
+        if not confirmed:
+            metadata = None
+    if not metadata:
+        metadata = infer_metadata(archive, settings, parser, batch)
+        if not metadata and batch:
+            queue.park(archive.source_file, "No metadata to search with", [])
+            return None
+    # region Delete extras
+    for child in list_files(archive.extracted_folder):
+        if child.suffix not in SUPPORTED_IMAGE_EXTENSIONS:
+            CONSOLE.print(f"Deleting {child.name}", style="logging.level.debug")
+            child.unlink(missing_ok=True)
+    # endregion
+    load_series_identity(metadata, settings)
+    pop_undecided()
+    unresolved = pull_info(
+        metadata, services, settings.general.resolution_order, interactive=not batch
+    )
+    if batch:
+        decisions = pop_undecided()
+        # Services that simply don't have the issue are fine, as long as one of them did
+        if unresolved and (decisions or not metadata.issue.resources):
+            queue.park(archive.source_file, f"Unresolved on {', '.join(unresolved)}", decisions)
+            return None
+
+    if manual_edit and not batch:
+        write_info_file(archive, settings, metadata)
+        CONSOLE.print(
+            Panel.fit(
+                Syntax(
+                    metadata.json(indent=2, ensure_ascii=False),
+                    "json",
+                    indent_guides=True,
+                    theme="ansi_dark",
+                    word_wrap=True,
+                ),
+                box=box.SQUARE,
+                border_style="syntax.border",
+            ),
+        )
+        CONSOLE.print(
+            f"Metadata file is at: {archive.extracted_folder / 'Metadata.json'}",
+            style="logging.level.info",
+        )
+        Prompt.ask("Press <Enter> to continue", console=CONSOLE)
+        metadata = read_info_file(archive)
+    write_info_file(archive, settings, metadata)
+    return metadata
+
+
+def pack_archive(
+    archive: Archive,
+    metadata: Metadata,
+    settings: Settings,
+    policy: CompressionPolicy,
+    debug: bool = False,
+    ids: Optional[IdIndex] = None,
+    queue: Optional[ReviewQueue] = None,
+):
+    if archive.archive(metadata, settings.general, policy):
+        write_series_file(archive.result_file.parent, metadata)
+        if ids:
+            ids.link_metadata(metadata)
+        if queue:
+            queue.remove(archive.source_file)
+        if not debug:
+            archive.source_file.unlink(missing_ok=True)
+    else:
+        CONSOLE.print(f"Unable to archive: {archive.result_file.name}", style="logging.level.error")
+    del_folder(archive.extracted_folder)
+
+
+def import_archives(
+    archive_files: List[Path],
+    settings: Settings,
+    services: Dict[str, Union[HimonTalker, MokkariTalker, SimyanTalker, EsakTalker]],
+    policy: CompressionPolicy,
+    args: Namespace,
+    ids: Optional[IdIndex] = None,
+    queue: Optional[ReviewQueue] = None,
+):
+    parser = FilenameParser(
+        root=settings.general.import_folder, collection=settings.general.collection_folder
+    )
+
+    def extract(file: Path) -> Optional[Tuple[Archive, Optional[Metadata]]]:
+        archive = Archive(
+            file, streaming=settings.general.streaming_repack and not args.manual_edit
+        )
+        if not archive.extract():
+            CONSOLE.print(f"Unable to extract: {file.name}", style="logging.level.error")
+            return None
+        return archive, read_info_file(archive, interactive=False)
+
+    def tag(extracted: Tuple[Archive, Optional[Metadata]]) -> Optional[Tuple[Archive, Metadata]]:
+        archive, metadata = extracted
+        CONSOLE.rule(f"[title]Importing {archive.source_file.name}[/]", style="subtitle.border")
+        if args.review:
+            show_review(queue.get(archive.source_file))
+        metadata = tag_archive(
+            archive, settings, services, args.manual_edit, queue, args.batch, metadata, parser
+        )
+        if not metadata:
+            del_folder(archive.extracted_folder)
+            return None
+        archive.locate(metadata, settings.general, interactive=not args.batch)
+        return archive, metadata
+
+    def pack(tagged: Tuple[Archive, Metadata]):
+        pack_archive(*tagged, settings, policy, args.debug, ids, queue)
+
+    pipeline = ImportPipeline(
+        extract=extract,
+        tag=tag,
+        pack=pack,
+        workers=settings.general.import_workers,
+        disk_limit=settings.general.import_disk_limit * 1024 * 1024,
+    )
+    try:
+        pipeline.run(archive_files)
+    finally:
+        print_stats((pipeline.throttled, pipeline))
+
+
+def review_files(queue: ReviewQueue) -> List[Path]:
+    output = []
+    for file in queue.files():
+        if file.exists():
+            output.append(file)
+        else:
+            CONSOLE.print(f"{file.name} no longer exists", style="logging.level.warning")
+            queue.remove(file)
+    return output
+
+
+def show_review(entry: Optional[Dict[str, Any]]):
+    if not entry:
+        return
+    lines = [f"[subtitle]Parked {entry['parked']}:[/] {entry['reason']}"]
+    for decision in entry["decisions"]:
+        lines.append(f"[prompt]{decision['prompt']}[/]")
+        lines.extend(f"  [prompt.choices]{x}[/]" for x in decision["options"])
+    CONSOLE.print(Panel.fit("\n".join(lines), box=box.SQUARE, border_style="subtitle.border"))
+
+
+def print_stats(*stats: Tuple[Any, Any]):
+    for used, entry in stats:
+        if used:
+            CONSOLE.print(str(entry), style="logging.level.info")
+
+
 def main():
     args = parse_arguments()
     setup_logging(args.debug)
@@ -131,92 +531,96 @@ def main():
     settings = Settings.load()
     settings.save()
 
+    memory = None
+    if settings.cache.memory_entries and settings.cache.memory_bytes:
+        memory = MemoryCache(
+            max_entries=settings.cache.memory_entries, max_bytes=settings.cache.memory_bytes
+        )
+    limiter = RateLimiter(
+        budgets={
+            x: [(y.calls, y.period) for y in getattr(settings, x).rate_limits]
+            for x in ["comicvine", "league_of_comic_geeks", "marvel", "metron"]
+        }
+    )
+    breaker = CircuitBreaker(
+        limits={
+            x: (getattr(settings, x).failure_threshold, getattr(settings, x).failure_cooldown)
+            for x in ["comicvine", "league_of_comic_geeks", "marvel", "metron"]
+        }
+    )
+    cache = SQLiteCache(
+        expiry=settings.cache.expiry or None,
+        memory=memory,
+        max_size=settings.cache.max_size,
+        compress=settings.cache.compress,
+        ttl=settings.cache.ttl,
+        stale=settings.cache.stale,
+        write_behind=settings.cache.write_behind,
+        flush_entries=settings.cache.flush_entries,
+        flush_interval=settings.cache.flush_interval,
+        limiter=limiter,
+        breaker=breaker,
+        negative=settings.cache.negative,
+    )
+    memo = ResolutionMemo()
+    ids = IdIndex(path=get_cache_root() / "ids.sqlite")
+    scorer = MatchScorer(threshold=settings.general.match_threshold)
+    queue = ReviewQueue()
     services = {}
     if settings.comicvine.api_key:
-        services["Comicvine"] = SimyanTalker(settings=settings.comicvine)
+        services["Comicvine"] = SimyanTalker(
+            settings=settings.comicvine, cache=cache, memo=memo, ids=ids, scorer=scorer
+        )
     if settings.metron.username and settings.metron.password:
-        services["Metron"] = MokkariTalker(settings=settings.metron)
+        services["Metron"] = MokkariTalker(
+            settings=settings.metron, cache=cache, memo=memo, ids=ids, scorer=scorer
+        )
     if settings.league_of_comic_geeks.client_id and settings.league_of_comic_geeks.client_secret:
-        services["League of Comic Geeks"] = HimonTalker(settings=settings.league_of_comic_geeks)
+        services["League of Comic Geeks"] = HimonTalker(
+            settings=settings.league_of_comic_geeks, cache=cache, ids=ids, scorer=scorer
+        )
     if settings.marvel.public_key and settings.marvel.private_key:
-        services["Marvel"] = EsakTalker(settings=settings.marvel)
+        services["Marvel"] = EsakTalker(
+            settings=settings.marvel, cache=cache, memo=memo, ids=ids, scorer=scorer
+        )
     settings.save()
 
     clean_cache()
 
+    policy = CompressionPolicy(
+        policy=settings.general.compression_policy,
+        level=settings.general.compression_level,
+        workers=settings.general.compression_workers,
+        seven_filter=settings.general.seven_filter,
+    )
     try:
-        for archive_file in list_files(
-            settings.general.import_folder, filter_=SUPPORTED_FILE_EXTENSIONS
-        ):
-            CONSOLE.rule(f"[title]Importing {archive_file.name}[/]", style="subtitle.border")
-            archive = Archive(archive_file)
-
-            if not archive.extract():
-                CONSOLE.print(
-                    f"Unable to extract: {archive.source_file.name}", style="logging.level.error"
-                )
-                continue
-
-            metadata = read_info_file(archive)
-            if metadata:
-                CONSOLE.print(
-                    Panel.fit(
-                        Syntax(
-                            metadata.json(indent=2, ensure_ascii=False),
-                            "json",
-                            indent_guides=True,
-                            theme="ansi_dark",
-                            word_wrap=True,
-                        ),
-                        box=box.SQUARE,
-                        border_style="syntax.border",
-                    ),
-                )
-                if not Confirm.ask("Keep Metadata", console=CONSOLE):
-                    metadata = None
-            if not metadata:
-                metadata = create_metadata()
-            # region Delete extras
-            for child in list_files(archive.extracted_folder):
-                if child.suffix not in SUPPORTED_IMAGE_EXTENSIONS:
-                    CONSOLE.print(f"Deleting {child.name}", style="logging.level.debug")
-                    child.unlink(missing_ok=True)
-            # endregion
-            pull_info(metadata, services, settings.general.resolution_order)
-
-            if args.manual_edit:
-                write_info_file(archive, settings, metadata)
-                CONSOLE.print(
-                    Panel.fit(
-                        Syntax(
-                            metadata.json(indent=2, ensure_ascii=False),
-                            "json",
-                            indent_guides=True,
-                            theme="ansi_dark",
-                            word_wrap=True,
-                        ),
-                        box=box.SQUARE,
-                        border_style="syntax.border",
-                    ),
-                )
-                CONSOLE.print(
-                    f"Metadata file is at: {archive.extracted_folder / 'Metadata.json'}",
-                    style="logging.level.info",
-                )
-                Prompt.ask("Press <Enter> to continue", console=CONSOLE)
-                metadata = read_info_file(archive)
-            write_info_file(archive, settings, metadata)
-
-            if archive.archive(metadata, settings.general):
-                if not args.debug:
-                    archive.source_file.unlink(missing_ok=True)
-            else:
-                CONSOLE.print(
-                    f"Unable to archive: {archive.result_file.name}", style="logging.level.error"
-                )
-            del_folder(archive.extracted_folder)
+        if args.review:
+            archive_files = review_files(queue)
+        else:
+            archive_files = list_files(
+                settings.general.import_folder, filter_=SUPPORTED_FILE_EXTENSIONS
+            )
+        import_archives(archive_files, settings, services, policy, args, ids, queue)
     except KeyboardInterrupt:
         CONSOLE.print("Shutting down Dex-Starr", style="logging.level.info")
+    finally:
+        cache.close()
+        ids.close()
+    print_stats(
+        (policy.stats.entries or policy.stats.copied_entries, policy.stats),
+        (cache.memory and (cache.memory.hits or cache.memory.misses), cache.memory),
+        (cache.evicted or cache.revalidated, cache),
+        (limiter.throttled or limiter.rejected, limiter),
+        (breaker.tripped or breaker.skipped, breaker),
+        (memo.hits, memo),
+        (ids.found, ids),
+        (scorer.chosen or scorer.prompted, scorer),
+    )
+    if queue and not args.review:
+        CONSOLE.print(
+            f"{len(queue)} archives waiting for review, run with --review to go through them",
+            style="logging.level.warning",
+        )
 
 
 if __name__ == "__main__":
@@ -1,10 +1,23 @@
 __all__ = ["Archive"]
 
+import os
 import shutil
-from pathlib import Path
-from typing import Optional
-from zipfile import ZIP_DEFLATED, BadZipFile, ZipFile
+import struct
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory, mkdtemp, mkstemp
+from threading import Lock
+from typing import IO, Callable, Deque, Dict, Iterable, Iterator, Optional, Set, Tuple
+from zipfile import ZIP64_LIMIT, ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile, ZipInfo
 
+from natsort import humansorted as sorted
+from natsort import ns
 from patoolib import extract_archive
 from patoolib.util import PatoolError
 
@@ -12,20 +25,174 @@
     SUPPORTED_FILE_EXTENSIONS,
     SUPPORTED_IMAGE_EXTENSIONS,
     SUPPORTED_INFO_FILES,
+    del_folder,
     get_cache_root,
     list_files,
 )
+from dex_starr.compression import SAMPLE_SIZE, CompressionPolicy, DeflatedEntry
 from dex_starr.console import CONSOLE
 from dex_starr.models.metadata.schema import Metadata
 from dex_starr.settings import GeneralSettings
 
+STREAMABLE_FILE_EXTENSIONS = [".cbz", ".cbt", ".cb7"]
+# Destinations being packed by any thread, claimed until the archive has been moved in place
+CLAIMED: Set[Path] = set()
+CLAIMED_LOCK = Lock()
+
+
+def is_image(name: str) -> bool:
+    return PurePosixPath(name).suffix in SUPPORTED_IMAGE_EXTENSIONS
+
+
+def is_info_file(name: str) -> bool:
+    return PurePosixPath(name).name in SUPPORTED_INFO_FILES
+
+
+class Member:
+    def __init__(self, opener: Callable[[], IO[bytes]], size: int):
+        self.opener = opener
+        self.size = size
+
+    def __call__(self) -> IO[bytes]:
+        return self.opener()
+
+
+class ZipMember(Member):
+    def __init__(self, source: ZipFile, info: ZipInfo):
+        super().__init__(opener=partial(source.open, info), size=info.file_size)
+        self.source = source
+        self.info = info
+
+    @property
+    def is_raw_copyable(self) -> bool:
+        return not self.info.flag_bits & 0x01
+
+
+def write_raw_entry(target: ZipFile, zinfo: ZipInfo, chunks: Iterable[bytes]):
+    """Append already compressed data to target, zinfo must hold the final sizes and CRC."""
+    zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+    with target._lock:
+        target.fp.seek(target.start_dir)
+        zinfo.header_offset = target.fp.tell()
+        target._writecheck(zinfo)
+        target._didModify = True
+        target.fp.write(zinfo.FileHeader(zip64))
+        for chunk in chunks:
+            target.fp.write(chunk)
+        target.filelist.append(zinfo)
+        target.NameToInfo[zinfo.filename] = zinfo
+        target.start_dir = target.fp.tell()
+
+
+def read_raw_member(member: ZipMember) -> Iterator[bytes]:
+    info = member.info
+    with member.source._lock:
+        member.source.fp.seek(info.header_offset)
+        header = struct.unpack(
+            zipfile.structFileHeader, member.source.fp.read(zipfile.sizeFileHeader)
+        )
+        if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+            raise BadZipFile(f"Bad magic number for file header: {info.filename}")
+        member.source.fp.seek(
+            header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1
+        )
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = member.source.fp.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise BadZipFile(f"Truncated file data: {info.filename}")
+            yield chunk
+            remaining -= len(chunk)
+
+
+def copy_zip_member(member: ZipMember, target: ZipFile, arcname: str):
+    """Copy the compressed bytes of a zip member into target without recompressing them."""
+    info = member.info
+    zinfo = ZipInfo(arcname, date_time=info.date_time)
+    zinfo.compress_type = info.compress_type
+    # Keep the compression option bits only, sizes are always written in the local header.
+    zinfo.flag_bits = info.flag_bits & 0x06
+    zinfo.external_attr = info.external_attr
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    write_raw_entry(target, zinfo, read_raw_member(member))
+
 
 class Archive:
-    def __init__(self, file: Path):
+    def __init__(self, file: Path, streaming: bool = False):
         self.source_file = file
+        self.streaming = streaming and file.suffix in STREAMABLE_FILE_EXTENSIONS
         self.extracted_folder: Optional[Path] = None
         self.result_file: Optional[Path] = None
 
+    @contextmanager
+    def _open_zip(self, filter_: Callable[[str], bool]) -> Iterator[Dict[str, Member]]:
+        with ZipFile(self.source_file, "r") as stream:
+            yield {
+                x.filename: ZipMember(stream, x)
+                for x in stream.infolist()
+                if not x.is_dir() and filter_(x.filename)
+            }
+
+    @contextmanager
+    def _open_tar(self, filter_: Callable[[str], bool]) -> Iterator[Dict[str, Member]]:
+        with tarfile.open(self.source_file, "r") as stream:
+            yield {
+                x.name: Member(opener=partial(stream.extractfile, x), size=x.size)
+                for x in stream.getmembers()
+                if x.isfile() and filter_(x.name)
+            }
+
+    @contextmanager
+    def _open_seven(self, filter_: Callable[[str], bool]) -> Iterator[Dict[str, Member]]:
+        from py7zr import SevenZipFile
+
+        # py7zr can only decompress a solid archive front to back, so the selected members are
+        # unpacked in a single pass to a scratch folder and opened from there when needed
+        with SevenZipFile(self.source_file, "r") as stream, TemporaryDirectory(
+            dir=get_cache_root()
+        ) as scratch:
+            targets = [
+                x.filename for x in stream.list() if not x.is_directory and filter_(x.filename)
+            ]
+            if targets:
+                stream.extract(path=scratch, targets=targets)
+            members = {}
+            for name in targets:
+                file = Path(scratch) / name
+                members[name] = Member(opener=partial(file.open, "rb"), size=file.stat().st_size)
+            yield members
+
+    @contextmanager
+    def _open_source(self, filter_: Callable[[str], bool]) -> Iterator[Dict[str, Member]]:
+        if self.source_file.suffix == ".cbz":
+            opener = self._open_zip
+        elif self.source_file.suffix == ".cbt":
+            opener = self._open_tar
+        elif self.source_file.suffix == ".cb7":
+            opener = self._open_seven
+        else:
+            raise NotImplementedError(f"Unable to stream: {self.source_file.name}")
+        with opener(filter_) as members:
+            yield members
+
+    def _extract_info_files(self, extracted_folder: Path) -> bool:
+        try:
+            with self._open_source(is_info_file) as members:
+                # Info files are read from the top of the folder, the shallowest copy wins
+                for name in sorted(members, key=lambda x: len(PurePosixPath(x).parts)):
+                    target = extracted_folder / PurePosixPath(name).name
+                    if target.exists():
+                        continue
+                    with members[name]() as src, target.open("wb") as dest:
+                        shutil.copyfileobj(src, dest)
+            self.extracted_folder = extracted_folder
+            return True
+        except (BadZipFile, tarfile.TarError) as err:
+            CONSOLE.print(err, style="logging.level.error")
+            return False
+
     def _extract_zip(self, extracted_folder: Path) -> bool:
         try:
             with ZipFile(self.source_file, "r") as stream:
@@ -57,15 +224,16 @@ def _extract_archive(self, extracted_folder: Path) -> bool:
 
     def extract(self) -> bool:
         CONSOLE.print(f"Extracting {self.source_file.name}", style="logging.level.info")
-        extracted_folder = get_cache_root() / self.source_file.stem
-        if extracted_folder.exists():
-            CONSOLE.print(
-                f"{extracted_folder.name} already exists in {extracted_folder.parent.name}",
-                style="logging.level.warning",
-            )
-            return False
-        extracted_folder.mkdir(parents=True, exist_ok=True)
+        # Archives are extracted ahead of each other, ones sharing a name each get their own folder
+        extracted_folder = Path(mkdtemp(dir=get_cache_root(), prefix=f"{self.source_file.stem}-"))
+        if self._extract(extracted_folder):
+            return True
+        del_folder(extracted_folder)
+        return False
 
+    def _extract(self, extracted_folder: Path) -> bool:
+        if self.streaming:
+            return self._extract_info_files(extracted_folder)
         if self.source_file.suffix == ".cbz":
             return self._extract_zip(extracted_folder)
         if self.source_file.suffix == ".cb7":
@@ -77,69 +245,199 @@ def extract(self) -> bool:
         )
         return False
 
+    def _page_name(self, index: int, page_count: int, suffix: str) -> str:
+        return f"{self.result_file.stem}-{str(index).zfill(len(str(page_count)))}{suffix}"
+
     def _rename_images(self):
         image_list = list_files(self.extracted_folder, filter_=SUPPORTED_IMAGE_EXTENSIONS)
-        list_length = len(str(len(image_list)))
         for index, img_file in enumerate(image_list):
             img_file.rename(
-                self.extracted_folder
-                / f"{self.result_file.stem}-{str(index).zfill(list_length)}{img_file.suffix}"
+                self.extracted_folder / self._page_name(index, len(image_list), img_file.suffix)
             )
 
-    def _archive_zip(self, archive_file: Path):
-        with ZipFile(archive_file, "w", ZIP_DEFLATED) as stream:
-            for file in list_files(self.extracted_folder):
-                if file.suffix in SUPPORTED_IMAGE_EXTENSIONS:
-                    stream.write(file, file.relative_to(self.extracted_folder))
-                elif file.name in SUPPORTED_INFO_FILES:
-                    stream.write(file, file.relative_to(self.extracted_folder))
-                else:
-                    CONSOLE.print(
-                        f"Unsupported file found: {file.name}", style="logging.level.warning"
-                    )
+    def _rename_members(self, members: Dict[str, Member]) -> Dict[str, Member]:
+        # Sorted as paths but looked up by the original name, which may start with ./
+        image_list = sorted(members, key=PurePosixPath, alg=ns.NA | ns.G | ns.P)
+        return {
+            self._page_name(index, len(image_list), PurePosixPath(name).suffix): members[name]
+            for index, name in enumerate(image_list)
+        }
+
+    def _list_extracted(self, filter_: Callable[[str], bool]) -> Dict[str, Member]:
+        entries = {}
+        for file in list_files(self.extracted_folder):
+            if filter_(file.name):
+                entries[file.relative_to(self.extracted_folder).as_posix()] = Member(
+                    opener=partial(file.open, "rb"), size=file.stat().st_size
+                )
+            else:
+                CONSOLE.print(f"Unsupported file found: {file.name}", style="logging.level.warning")
+        return entries
+
+    def _write_zip_entry(
+        self, stream: ZipFile, arcname: str, member: Member, policy: CompressionPolicy
+    ):
+        if isinstance(member, ZipMember) and member.is_raw_copyable:
+            copy_zip_member(member, stream, arcname)
+            info = stream.getinfo(arcname)
+            policy.stats.add_copied(info.compress_size)
+            return
+        start = time.thread_time()
+        with member() as src:
+            sample = src.read(SAMPLE_SIZE)
+            compress = policy.should_compress(arcname, sample)
+            stream.compression = ZIP_DEFLATED if compress else ZIP_STORED
+            with stream.open(arcname, "w") as dest:
+                dest.write(sample)
+                shutil.copyfileobj(src, dest)
+        info = stream.getinfo(arcname)
+        policy.stats.add(info.file_size, info.compress_size, time.thread_time() - start, compress)
+
+    def _write_deflated_entry(
+        self, stream: ZipFile, arcname: str, deflated: DeflatedEntry, policy: CompressionPolicy
+    ):
+        zinfo = ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = ZIP_DEFLATED if deflated.compressed else ZIP_STORED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.CRC = deflated.crc
+        zinfo.compress_size = len(deflated.data)
+        zinfo.file_size = deflated.size
+        write_raw_entry(stream, zinfo, [deflated.data])
+        policy.stats.add(
+            zinfo.file_size, zinfo.compress_size, deflated.cpu_seconds, deflated.compressed
+        )
+
+    def _archive_zip(
+        self, archive_file: Path, entries: Dict[str, Member], policy: CompressionPolicy
+    ):
+        with ZipFile(archive_file, "w", ZIP_DEFLATED, compresslevel=policy.level) as stream:
+            if policy.workers <= 1:
+                for arcname in sorted(entries, alg=ns.NA | ns.G | ns.P):
+                    self._write_zip_entry(stream, arcname, entries[arcname], policy)
+                return
+            # Entries are compressed ahead in the pool but always written in page order, at most
+            # two per worker are held in memory at once.
+            with ThreadPoolExecutor(max_workers=policy.workers) as pool:
+                pending: Deque[Tuple[str, Member, Optional[Future]]] = deque()
+                for arcname in sorted(entries, alg=ns.NA | ns.G | ns.P):
+                    member = entries[arcname]
+                    future = None
+                    if not isinstance(member, ZipMember) or not member.is_raw_copyable:
+                        with member() as src:
+                            future = pool.submit(policy.deflate, arcname, src.read())
+                    pending.append((arcname, member, future))
+                    while len(pending) > policy.workers * 2:
+                        self._flush_zip_entry(stream, policy, *pending.popleft())
+                while pending:
+                    self._flush_zip_entry(stream, policy, *pending.popleft())
+
+    def _flush_zip_entry(
+        self,
+        stream: ZipFile,
+        policy: CompressionPolicy,
+        arcname: str,
+        member: Member,
+        future: Optional[Future],
+    ):
+        if future is None:
+            self._write_zip_entry(stream, arcname, member, policy)
+        else:
+            self._write_deflated_entry(stream, arcname, future.result(), policy)
 
-    def _archive_seven(self, archive_file: Path):
+    def _archive_seven(
+        self, archive_file: Path, entries: Dict[str, Member], policy: CompressionPolicy
+    ):
         from py7zr import SevenZipFile
 
-        with SevenZipFile(archive_file, "w") as stream:
-            for file in list_files(self.extracted_folder):
-                if file.suffix in SUPPORTED_IMAGE_EXTENSIONS:
-                    stream.write(file, file.relative_to(self.extracted_folder))
-                elif file.name in SUPPORTED_INFO_FILES:
-                    stream.write(file, file.relative_to(self.extracted_folder))
-                else:
-                    CONSOLE.print(
-                        f"Unsupported file found: {file.name}", style="logging.level.warning"
-                    )
+        start = time.thread_time()
+        # py7zr applies one filter chain to the whole archive, so the entries vote by size.
+        compressible = 0
+        for arcname, member in entries.items():
+            with member() as src:
+                if policy.should_compress(arcname, src.read(SAMPLE_SIZE)):
+                    compressible += member.size
+        total = sum(x.size for x in entries.values())
+        compress = compressible * 2 > total
+        with SevenZipFile(archive_file, "w", filters=policy.seven_filters(compress)) as stream:
+            for arcname in sorted(entries, alg=ns.NA | ns.G | ns.P):
+                with entries[arcname]() as src:
+                    stream.writef(src, arcname)
+        policy.stats.add(total, archive_file.stat().st_size, time.thread_time() - start, compress)
+
+    def _archive_tar(
+        self, archive_file: Path, entries: Dict[str, Member], policy: CompressionPolicy
+    ):
+        with tarfile.open(archive_file, "w") as stream:
+            for arcname in sorted(entries, alg=ns.NA | ns.G | ns.P):
+                member = entries[arcname]
+                info = tarfile.TarInfo(arcname)
+                info.size = member.size
+                info.mtime = int(time.time())
+                with member() as src:
+                    stream.addfile(info, src)
+                policy.stats.add(member.size, member.size, 0.0, False)
 
-    def archive(self, metadata: Metadata, general: GeneralSettings) -> bool:
+    @contextmanager
+    def _open_entries(self) -> Iterator[Dict[str, Member]]:
+        if self.streaming:
+            with self._open_source(is_image) as members:
+                yield {**self._rename_members(members), **self._list_extracted(is_info_file)}
+        else:
+            self._rename_images()
+            yield self._list_extracted(lambda x: is_image(x) or is_info_file(x))
+
+    def locate(
+        self, metadata: Metadata, general: GeneralSettings, interactive: bool = True
+    ) -> Path:
         series_folder = (
             general.collection_folder / metadata.publisher.file_name / metadata.series.file_name
         )
         series_folder.mkdir(parents=True, exist_ok=True)
         self.result_file = (
             series_folder
-            / f"{metadata.series.file_name}{metadata.issue.file_name}.{general.output_format}"
+            / f"{metadata.series.file_name}{metadata.issue.get_file_name(interactive)}"
+            f".{general.output_format}"
         )
-        CONSOLE.print(f"Archiving {self.result_file.name}", style="logging.level.info")
-        if self.result_file.exists():
-            CONSOLE.print(f"{self.result_file.name} already exists", style="logging.level.error")
-            return False
-        self._rename_images()
+        return self.result_file
 
-        archive_file = self.extracted_folder.parent / self.result_file.name
-        if archive_file.exists():
-            return False
+    def archive(
+        self, metadata: Metadata, general: GeneralSettings, policy: CompressionPolicy
+    ) -> bool:
+        if not self.result_file:
+            self.locate(metadata, general)
+        CONSOLE.print(f"Archiving {self.result_file.name}", style="logging.level.info")
+        with CLAIMED_LOCK:
+            if self.result_file in CLAIMED or self.result_file.exists():
+                CONSOLE.print(
+                    f"{self.result_file.name} already exists", style="logging.level.error"
+                )
+                return False
+            CLAIMED.add(self.result_file)
+        try:
+            return self._archive(general, policy)
+        finally:
+            with CLAIMED_LOCK:
+                CLAIMED.discard(self.result_file)
 
+    def _archive(self, general: GeneralSettings, policy: CompressionPolicy) -> bool:
+        # Packed under a name of its own, archives with the same name can be packed at once
+        handle, name = mkstemp(dir=get_cache_root(), suffix=f".{general.output_format}")
+        os.close(handle)
+        archive_file = Path(name)
         try:
-            if general.output_format == "cbz":
-                self._archive_zip(archive_file)
-            elif general.output_format == "cb7":
-                self._archive_seven(archive_file)
-            else:
-                return False
-        except OSError as err:
+            with self._open_entries() as entries:
+                if general.output_format == "cbz":
+                    self._archive_zip(archive_file, entries, policy)
+                elif general.output_format == "cb7":
+                    self._archive_seven(archive_file, entries, policy)
+                elif general.output_format == "cbt":
+                    self._archive_tar(archive_file, entries, policy)
+                else:
+                    return False
+            shutil.move(archive_file, self.result_file)
+            return True
+        except (OSError, BadZipFile, tarfile.TarError) as err:
             CONSOLE.print(err, style="logging.level.error")
             return False
-
-        return shutil.move(archive_file, self.result_file)
+        finally:
+            archive_file.unlink(missing_ok=True)
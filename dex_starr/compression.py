@@ -0,0 +1,138 @@
+__all__ = [
+    "COMPRESSION_POLICIES",
+    "SAMPLE_SIZE",
+    "SEVEN_FILTERS",
+    "CompressionPolicy",
+    "CompressionStats",
+    "DeflatedEntry",
+]
+
+import time
+import zlib
+from pathlib import PurePosixPath
+from threading import Lock
+from typing import Dict, List
+
+COMPRESSION_POLICIES = ["adaptive", "compress", "store"]
+SEVEN_FILTERS = ["lzma2", "zstd"]
+# Entropy coded formats, deflating these saves next to nothing.
+INCOMPRESSIBLE_EXTENSIONS = [".jpg", ".jpeg"]
+SAMPLE_SIZE = 64 * 1024
+MIN_SAVINGS = 0.05
+
+
+def format_bytes(value: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TiB"
+
+
+class CompressionStats:
+    def __init__(self):
+        self.entries = 0
+        self.compressed_entries = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self.copied_entries = 0
+        self.copied_bytes = 0
+        self._lock = Lock()
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+
+    def add(
+        self,
+        bytes_in: int,
+        bytes_out: int,
+        cpu_seconds: float,
+        compressed: bool,
+        entries: int = 1,
+    ):
+        with self._lock:
+            self.entries += entries
+            if compressed:
+                self.compressed_entries += entries
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu_seconds
+
+    def add_copied(self, bytes_out: int):
+        # Copied as they were, so they say nothing about the policy or the CPU it cost
+        with self._lock:
+            self.copied_entries += 1
+            self.copied_bytes += bytes_out
+
+    def __str__(self):
+        output = (
+            f"Compressed {self.compressed_entries}/{self.entries} entries, "
+            f"saved {format_bytes(self.bytes_saved)} of {format_bytes(self.bytes_in)} "
+            f"using {self.cpu_seconds:.2f}s CPU"
+        )
+        if self.copied_entries:
+            output += (
+                f", copied {self.copied_entries} entries "
+                f"({format_bytes(self.copied_bytes)}) unchanged"
+            )
+        return output
+
+
+class DeflatedEntry:
+    def __init__(self, data: bytes, crc: int, size: int, compressed: bool, cpu_seconds: float):
+        self.data = data
+        self.crc = crc
+        self.size = size
+        self.compressed = compressed
+        self.cpu_seconds = cpu_seconds
+
+
+class CompressionPolicy:
+    def __init__(
+        self,
+        policy: str = "adaptive",
+        level: int = 6,
+        workers: int = 1,
+        seven_filter: str = "lzma2",
+    ):
+        self.policy = policy
+        self.level = level
+        self.workers = workers
+        self.seven_filter = seven_filter
+        self.stats = CompressionStats()
+
+    def should_compress(self, arcname: str, sample: bytes) -> bool:
+        if self.policy == "store":
+            return False
+        if self.policy == "compress":
+            return True
+        if PurePosixPath(arcname).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS or not sample:
+            return False
+        return len(zlib.compress(sample, 1)) < len(sample) * (1 - MIN_SAVINGS)
+
+    def deflate(self, arcname: str, data: bytes) -> DeflatedEntry:
+        start = time.thread_time()
+        crc = zlib.crc32(data)
+        compressed = self.should_compress(arcname, data[:SAMPLE_SIZE])
+        output = data
+        if compressed:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            output = compressor.compress(data) + compressor.flush()
+        return DeflatedEntry(
+            data=output,
+            crc=crc,
+            size=len(data),
+            compressed=compressed,
+            cpu_seconds=time.thread_time() - start,
+        )
+
+    def seven_filters(self, compress: bool) -> List[Dict[str, int]]:
+        from py7zr import FILTER_COPY, FILTER_LZMA2, FILTER_ZSTD
+
+        if not compress:
+            return [{"id": FILTER_COPY}]
+        if self.seven_filter == "zstd":
+            return [{"id": FILTER_ZSTD, "level": self.level}]
+        return [{"id": FILTER_LZMA2, "preset": self.level}]
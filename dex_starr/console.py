@@ -1,6 +1,8 @@
-__all__ = ["CONSOLE", "create_menu"]
+__all__ = ["CONSOLE", "create_menu", "pop_undecided", "silenced"]
 
-from typing import List, Optional
+from contextlib import contextmanager
+from threading import Lock, local
+from typing import List, Optional, Tuple
 
 from rich import box
 from rich.console import Console
@@ -8,7 +10,26 @@
 from rich.prompt import IntPrompt
 from rich.theme import Theme
 
-CONSOLE = Console(
+# Threads running speculative work print nothing and leave no menus behind
+quiet = local()
+
+
+class QuietConsole(Console):
+    def print(self, *args, **kwargs):
+        if not getattr(quiet, "active", False):
+            super().print(*args, **kwargs)
+
+
+@contextmanager
+def silenced():
+    quiet.active = True
+    try:
+        yield
+    finally:
+        quiet.active = False
+
+
+CONSOLE = QuietConsole(
     theme=Theme(
         {
             "prompt": "green",
@@ -29,10 +50,29 @@
     )
 )
 
+# Menus that were passed over while not interactive, so a batch run can park them for review
+undecided: List[Tuple[str, List[str]]] = []
+undecided_lock = Lock()
+
+
+def pop_undecided() -> List[Tuple[str, List[str]]]:
+    with undecided_lock:
+        output = undecided.copy()
+        undecided.clear()
+    return output
 
-def create_menu(options: List[str], prompt: str, default: Optional[str] = None) -> Optional[int]:
+
+def create_menu(
+    options: List[str], prompt: str, default: Optional[str] = None, interactive: bool = True
+) -> Optional[int]:
     if not options:
         return 0
+    if not interactive:
+        # Nothing is chosen without asking, the options are kept for a later review
+        if not getattr(quiet, "active", False):
+            with undecided_lock:
+                undecided.append((prompt, [str(x) for x in options]))
+        return 0
     panel_text = []
     for index, item in enumerate(options):
         panel_text.append(f"[prompt]{index + 1}:[/] [prompt.choices]{item}[/]")
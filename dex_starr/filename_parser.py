@@ -0,0 +1,240 @@
+__all__ = ["FilenameParser", "ParsedName", "Rule", "RULES"]
+
+import re
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Pattern
+
+from pydantic import ValidationError
+
+from dex_starr.console import CONSOLE
+from dex_starr.models.metadata.enums import Format
+from dex_starr.models.metadata.schema import (
+    Issue,
+    Metadata,
+    Publisher,
+    Series,
+    SeriesIdentity,
+    sanitize,
+)
+
+REQUIRED = ["publisher", "series", "number"]
+FORMATS = {
+    "annual": Format.ANNUAL,
+    "gn": Format.GRAPHIC_NOVEL,
+    "graphic novel": Format.GRAPHIC_NOVEL,
+    "hardcover": Format.HARDCOVER,
+    "hc": Format.HARDCOVER,
+    "tpb": Format.TRADE_PAPERBACK,
+    "trade paperback": Format.TRADE_PAPERBACK,
+}
+COLLECTED = [Format.GRAPHIC_NOVEL, Format.HARDCOVER, Format.TRADE_PAPERBACK]
+
+
+class Rule:
+    """A pattern searched for in what is left of the name, and what a match says about it.
+
+    apply gets the match and the fields found so far, and returns the fields it found with how
+    confident it is in each. The matched text is removed from the name unless consume is False or
+    apply returns None, whatever is left once every rule has run becomes the series title.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        apply: Callable[[re.Match, Dict[str, tuple]], Optional[Dict[str, tuple]]],
+        consume: bool = True,
+        flags: int = re.IGNORECASE,
+    ):
+        self.name = name
+        self.pattern: Pattern = re.compile(pattern, flags)
+        self.apply = apply
+        self.consume = consume
+
+
+def _year(match: re.Match, fields: Dict[str, tuple]) -> Dict[str, tuple]:
+    return {"year": (int(match.group(1)), 0.9)}
+
+
+def _format(match: re.Match, fields: Dict[str, tuple]) -> Dict[str, tuple]:
+    return {"format": (FORMATS[" ".join(match.group(1).casefold().split())], 0.9)}
+
+
+def _volume(match: re.Match, fields: Dict[str, tuple]) -> Dict[str, tuple]:
+    return {"volume": (int(match.group(1)), 0.95)}
+
+
+def _number(match: re.Match, fields: Dict[str, tuple]) -> Dict[str, tuple]:
+    return {"number": (match.group(1).lstrip("0") or "0", 0.95)}
+
+
+def _trailing_number(match: re.Match, fields: Dict[str, tuple]) -> Optional[Dict[str, tuple]]:
+    if "number" in fields:
+        return None
+    # Collected editions are numbered by their volume, a number before it belongs to the title
+    if "volume" in fields and fields.get("format", (None, 0))[0] in COLLECTED:
+        return None
+    # Scene names pad numbers to three digits, anything else could as well be part of the title
+    digits = len(re.match(r"\d*", match.group(1)).group(0))
+    if match.group(1).startswith("0") or digits == 3:
+        confidence = 0.85
+    else:
+        confidence = 0.5 if digits > 3 else 0.7
+    return {
+        "number": (match.group(1).lstrip("0") or "0", confidence),
+        "title_number": (match.group(1), confidence),
+    }
+
+
+RULES = [
+    Rule("year", r"[(\[]((?:19|20)\d{2})[)\]]", _year),
+    Rule("count", r"\(of\s*\d+\)", lambda match, fields: {}),
+    Rule("format", r"[(\[](tpb|hc|gn|trade paperback|hardcover|graphic novel)[)\]]", _format),
+    Rule("format", r"\b(tpb|hc|gn|trade paperback|hardcover|graphic novel)\b", _format),
+    # Annuals are their own series on the services, so the title keeps the word
+    Rule("annual", r"\b(annual)\b", _format, consume=False),
+    Rule("tag", r"[(\[][^)\]]*[)\]]", lambda match, fields: {}),
+    Rule("volume", r"\bv(?:ol(?:ume)?)?\.?\s*(\d+)\b", _volume),
+    Rule("number", r"#\s*(-?\d+(?:\.\d+)?[a-z]?|½|∞)", _number),
+    Rule("number", r"(?<=\s)(\d{1,4}(?:\.\d+)?[a-z]?)\s*$", _trailing_number),
+]
+
+
+class ParsedName:
+    def __init__(self, metadata: Metadata, confidence: Dict[str, float]):
+        self.metadata = metadata
+        self.confidence = confidence
+
+    @property
+    def score(self) -> float:
+        return min(self.confidence.get(x, 0.0) for x in REQUIRED)
+
+    def __str__(self):
+        return (
+            f"{self.metadata.publisher.title or '?'} / {self.metadata.series.title or '?'} "
+            f"v{self.metadata.series.volume} #{self.metadata.issue.number or '?'} "
+            f"({self.score:.0%})"
+        )
+
+
+class FilenameParser:
+    """Drafts Metadata from an archive's filename and the folders it was imported from.
+
+    The name is run through the rules in order, see Rule, and the first folder below root names
+    the publisher with a second naming the series. Series already in the collection fill in the
+    publisher when no folder does. Every field comes with how confident the parser is in it, and
+    the draft scores as its least confident publisher, series or number.
+    """
+
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        collection: Optional[Path] = None,
+        rules: Optional[List[Rule]] = None,
+    ):
+        self.root = root
+        self.collection = collection
+        self.rules = rules if rules is not None else list(RULES)
+        self._publishers: Optional[Dict[str, str]] = None
+        self._series: Optional[Dict[str, Path]] = None
+
+    def _scan_collection(self):
+        self._publishers, self._series = {}, {}
+        if not self.collection or not self.collection.is_dir():
+            return
+        for publisher in self.collection.iterdir():
+            if not publisher.is_dir():
+                continue
+            self._publishers[sanitize(publisher.name).casefold()] = publisher.name
+            for series in publisher.iterdir():
+                if series.is_dir():
+                    self._series.setdefault(series.name.casefold(), series)
+
+    def known_publisher(self, title: str) -> Optional[str]:
+        if self._publishers is None:
+            self._scan_collection()
+        return self._publishers.get(sanitize(title).casefold())
+
+    def known_series(self, series: Series) -> Optional[Publisher]:
+        if self._series is None:
+            self._scan_collection()
+        if not (folder := self._series.get(series.file_name.casefold())):
+            return None
+        if (identity_file := folder / "Series.json").exists():
+            try:
+                return SeriesIdentity.from_file(identity_file).publisher
+            except (ValidationError, JSONDecodeError, KeyError, OSError) as err:
+                CONSOLE.print(f"Unable to parse Series.json: {err}", style="logging.level.warning")
+        return Publisher(title=folder.parent.name.replace("-", " "))
+
+    def is_series(self, title: str, folder: Optional[str]) -> bool:
+        if folder and sanitize(folder).casefold() == sanitize(title).casefold():
+            return True
+        return self.known_series(Series(title=title)) is not None
+
+    def parse_name(self, name: str) -> Dict[str, tuple]:
+        if " " not in name:
+            name = name.replace("_", " ") if "_" in name else name.replace(".", " ")
+        fields: Dict[str, tuple] = {}
+
+        def replace(match: re.Match) -> str:
+            if (found := rule.apply(match, fields)) is None:
+                return match.group(0)
+            for key, value in found.items():
+                fields.setdefault(key, value)
+            return " " if rule.consume else match.group(0)
+
+        for rule in self.rules:
+            name = rule.pattern.sub(replace, name)
+        if title := " ".join(name.split()).strip(" -_,"):
+            fields["series"] = (title, 0.8)
+        return fields
+
+    def folders(self, file: Path) -> List[str]:
+        if not self.root:
+            return []
+        try:
+            return list(file.parent.relative_to(self.root).parts)
+        except ValueError:
+            return []
+
+    def parse(self, file: Path) -> ParsedName:
+        fields = self.parse_name(file.stem)
+        folders = self.folders(file)
+        folder = " ".join(folders[1].replace("_", " ").split()) if len(folders) > 1 else None
+        # A number ending the name could be part of the title, e.g. Spider-Man 2099, it is kept
+        # with it when a folder or the collection names the series that way.
+        if title_number := fields.pop("title_number", None):
+            title = " ".join(x for x in [fields.get("series", ("", 0))[0], title_number[0]] if x)
+            if self.is_series(title, folder):
+                del fields["number"]
+                fields["series"] = (title, 0.8)
+        if folder:
+            if "series" not in fields:
+                fields["series"] = (folder, 0.8)
+            elif sanitize(folder).casefold() == sanitize(fields["series"][0]).casefold():
+                fields["series"] = (fields["series"][0], 1.0)
+        if folders:
+            fields["publisher"] = (folders[0], 1.0 if self.known_publisher(folders[0]) else 0.9)
+        # Collected editions are numbered by their volume
+        if "number" not in fields and "volume" in fields and "format" in fields:
+            fields["number"] = (str(fields.pop("volume")[0]), 0.8)
+
+        series = Series(
+            title=fields.get("series", ("", 0))[0], volume=fields.get("volume", (1, 0))[0]
+        )
+        if "publisher" not in fields and series.title:
+            if publisher := self.known_series(series):
+                fields["publisher"] = (publisher.title, 0.9)
+                fields["series"] = (series.title, 1.0)
+        number = fields.get("number", ("", 0))[0]
+        # The year on a first issue is the year the series started, on later ones it isn't
+        if "year" in fields and number == "1":
+            series.start_year = fields["year"][0]
+        metadata = Metadata(
+            publisher=Publisher(title=fields.get("publisher", ("", 0))[0]),
+            series=series,
+            issue=Issue(format=fields.get("format", (Format.COMIC, 0))[0], number=number),
+        )
+        return ParsedName(metadata=metadata, confidence={k: v[1] for k, v in fields.items()})
@@ -7,6 +7,7 @@
     "Issue",
     "Page",
     "Metadata",
+    "SeriesIdentity",
 ]
 
 import json
@@ -186,6 +187,9 @@ def to_genre_enum(cls, v) -> Genre:
 
     @property
     def file_name(self) -> str:
+        return self.get_file_name()
+
+    def get_file_name(self, interactive: bool = True) -> str:
         if self.format == Format.ANNUAL:
             return f"-Annual-#{self.number.zfill(2)}"
         if self.format == Format.DIGITAL_CHAPTER:
@@ -193,11 +197,14 @@ def file_name(self) -> str:
         if self.format == Format.COMIC:
             return f"-#{self.number.zfill(3)}"
         output = ""
-        index = create_menu(
-            options=["Show number and title", "Show only number", "Show only title"],
-            prompt="File naming format",
-            default="Show neither",
-        )
+        if interactive:
+            index = create_menu(
+                options=["Show number and title", "Show only number", "Show only title"],
+                prompt="File naming format",
+                default="Show neither",
+            )
+        else:
+            index = 2 if self.number else 3
         if index in [1, 2]:
             output += f"-#{self.number.zfill(2)}"
         if index in [1, 3]:
@@ -311,6 +318,31 @@ def __hash__(self):
         return hash((type(self), self.publisher, self.series, self.issue))
 
 
+class SeriesIdentity(CamelModel):
+    publisher: Publisher
+    series: Series
+
+    @staticmethod
+    def from_file(identity_file: Path) -> "SeriesIdentity":
+        with identity_file.open("r", encoding="UTF-8") as stream:
+            content = json.load(stream)
+            return SeriesIdentity(**content["content"])
+
+    def to_file(self, identity_file: Path):
+        content = self.dict(by_alias=True)
+        content = clean_contents(content)
+
+        with identity_file.open("w", encoding="UTF-8") as stream:
+            json.dump(
+                {"content": content, "meta": generate_meta()},
+                stream,
+                sort_keys=True,
+                default=str,
+                indent=2,
+                ensure_ascii=False,
+            )
+
+
 def generate_meta() -> Dict[str, str]:
     return {"date": date.today().isoformat(), "tool": {"name": "Dex-Starr", "version": __version__}}
 
@@ -13,17 +13,24 @@
 from dex_starr.models.metron_info.schema import MetronInfo
 
 
-def create_metadata() -> Metadata:
-    publisher = Publisher(title=Prompt.ask("Publisher title", console=CONSOLE))
+def create_metadata(draft: Optional[Metadata] = None) -> Metadata:
+    # Whatever the draft has is offered as the default answer
+    draft = draft or Metadata(
+        publisher=Publisher(title=""), series=Series(title=""), issue=Issue(number="")
+    )
+    publisher = Publisher(
+        title=Prompt.ask("Publisher title", default=draft.publisher.title or None, console=CONSOLE)
+    )
     series = Series(
-        title=Prompt.ask("Series title", console=CONSOLE),
-        volume=IntPrompt.ask("Series volume", default=1, console=CONSOLE),
+        title=Prompt.ask("Series title", default=draft.series.title or None, console=CONSOLE),
+        volume=IntPrompt.ask("Series volume", default=draft.series.volume, console=CONSOLE),
+        start_year=draft.series.start_year,
     )
     formats = list(Format)
-    index = create_menu(options=formats, prompt="Issue format", default=Format.COMIC)
+    index = create_menu(options=formats, prompt="Issue format", default=draft.issue.format)
     issue = Issue(
-        format=formats[index - 1] if index else Format.COMIC,
-        number=Prompt.ask("Issue number", console=CONSOLE),
+        format=formats[index - 1] if index else draft.issue.format,
+        number=Prompt.ask("Issue number", default=draft.issue.number or None, console=CONSOLE),
     )
     return Metadata(publisher=publisher, series=series, issue=issue)
 
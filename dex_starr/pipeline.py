@@ -0,0 +1,142 @@
+__all__ = ["ImportPipeline", "disk_usage"]
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from queue import Queue
+from threading import Condition, Event, Thread
+from typing import Any, Callable, Iterable, List, Optional
+
+from dex_starr import get_cache_root
+from dex_starr.console import CONSOLE
+
+DONE = object()
+
+
+def disk_usage(folder: Path) -> int:
+    output = 0
+    for root, _, files in os.walk(folder):
+        for file in files:
+            try:
+                output += os.stat(os.path.join(root, file)).st_size
+            except OSError:
+                continue
+    return output
+
+
+class ImportPipeline:
+    """Extract, tag and pack archives as stages joined by bounded queues.
+
+    Extraction runs up to workers archives ahead of tagging, which happens on the calling thread
+    in the original order as it is where every prompt is asked. Tagged archives are handed to
+    workers packing threads. Either queue being full holds back the stage feeding it, and no
+    further archive is extracted while the folder holds more than disk_limit bytes, unless nothing
+    is left in flight to free any of it.
+    """
+
+    def __init__(
+        self,
+        extract: Callable[[Any], Optional[Any]],
+        tag: Callable[[Any], Optional[Any]],
+        pack: Callable[[Any], None],
+        workers: int = 1,
+        disk_limit: int = 0,
+        folder: Path = get_cache_root(),
+        poll: float = 1.0,
+    ):
+        self.extract = extract
+        self.tag = tag
+        self.pack = pack
+        self.workers = workers
+        self.disk_limit = disk_limit
+        self.folder = folder
+        self.poll = poll
+        self.extracted: Queue = Queue(maxsize=workers)
+        self.tagged: Queue = Queue(maxsize=workers)
+        self.in_flight = 0
+        self.condition = Condition()
+        self.stop = Event()
+        self.throttled = 0
+
+    def _wait_for_disk(self):
+        if not self.disk_limit:
+            return
+        waited = False
+        with self.condition:
+            while (
+                not self.stop.is_set()
+                and self.in_flight
+                and disk_usage(self.folder) > self.disk_limit
+            ):
+                if not waited:
+                    waited = True
+                    self.throttled += 1
+                    CONSOLE.print(
+                        f"Waiting on {self.in_flight} archives before extracting more",
+                        style="logging.level.debug",
+                    )
+                self.condition.wait(timeout=self.poll)
+
+    def _finished(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _produce(self, items: Iterable[Any], executor: ThreadPoolExecutor):
+        try:
+            for item in items:
+                self._wait_for_disk()
+                if self.stop.is_set():
+                    break
+                with self.condition:
+                    self.in_flight += 1
+                self.extracted.put(executor.submit(self.extract, item))
+        finally:
+            self.extracted.put(DONE)
+
+    def _consume(self):
+        while (item := self.tagged.get()) is not DONE:
+            try:
+                self.pack(item)
+            except Exception as err:
+                CONSOLE.print(f"Unable to pack: {err}", style="logging.level.error")
+            finally:
+                self._finished()
+
+    def run(self, items: Iterable[Any]):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            producer = Thread(target=self._produce, args=(items, executor), daemon=True)
+            producer.start()
+            packers = [Thread(target=self._consume, daemon=True) for _ in range(self.workers)]
+            for packer in packers:
+                packer.start()
+            try:
+                while (future := self.extracted.get()) is not DONE:
+                    self._tag(future)
+            except BaseException:
+                self.stop.set()
+                self._drain(executor)
+                raise
+            finally:
+                for _ in packers:
+                    self.tagged.put(DONE)
+                for packer in packers:
+                    packer.join()
+                producer.join()
+
+    def _tag(self, future: Future):
+        if (extracted := future.result()) is None or (tagged := self.tag(extracted)) is None:
+            self._finished()
+        else:
+            self.tagged.put(tagged)
+
+    def _drain(self, executor: ThreadPoolExecutor):
+        pending: List[Future] = []
+        while (future := self.extracted.get()) is not DONE:
+            pending.append(future)
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    def __str__(self):
+        return f"Import pipeline: held back {self.throttled} times on disk usage"
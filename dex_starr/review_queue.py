@@ -0,0 +1,65 @@
+__all__ = ["ReviewQueue"]
+
+import json
+from datetime import date
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from dex_starr import get_data_root
+from dex_starr.console import CONSOLE
+from dex_starr.models.metadata.schema import generate_meta
+
+
+class ReviewQueue:
+    """Archives a batch run couldn't decide on, kept until someone reviews them.
+
+    Each entry holds the reason the archive was parked and every menu that was skipped while
+    tagging it, with the options it would have offered.
+    """
+
+    def __init__(self, path: Path = get_data_root() / "review-queue.json"):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.lock = Lock()
+        if self.path.exists():
+            try:
+                with self.path.open("r", encoding="UTF-8") as stream:
+                    self.entries = {x["file"]: x for x in json.load(stream)["content"]}
+            except (OSError, KeyError, TypeError, ValueError) as err:
+                CONSOLE.print(f"Unable to read review queue: {err}", style="logging.level.warning")
+
+    def park(self, file: Path, reason: str, decisions: List[Tuple[str, List[str]]]):
+        CONSOLE.print(f"Parking {file.name} for review: {reason}", style="logging.level.warning")
+        with self.lock:
+            self.entries[str(file)] = {
+                "decisions": [{"prompt": x, "options": y} for x, y in decisions],
+                "file": str(file),
+                "parked": date.today().isoformat(),
+                "reason": reason,
+            }
+            self.save()
+
+    def get(self, file: Path) -> Optional[Dict[str, Any]]:
+        return self.entries.get(str(file))
+
+    def remove(self, file: Path):
+        with self.lock:
+            if self.entries.pop(str(file), None):
+                self.save()
+
+    def files(self) -> List[Path]:
+        return [Path(x) for x in self.entries]
+
+    def save(self):
+        with self.path.open("w", encoding="UTF-8") as stream:
+            json.dump(
+                {"content": list(self.entries.values()), "meta": generate_meta()},
+                stream,
+                sort_keys=True,
+                indent=2,
+                ensure_ascii=False,
+            )
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,83 @@
+__all__ = ["CircuitBreaker", "ServiceUnavailable", "is_outage"]
+
+import time
+from collections import Counter
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from requests.exceptions import ConnectionError, Timeout
+
+from dex_starr.console import CONSOLE
+
+
+class ServiceUnavailable(Exception):
+    def __init__(self, service: str, reason: str):
+        super().__init__(f"{service} is unavailable: {reason}")
+        self.service = service
+
+
+def is_outage(err: Optional[BaseException]) -> bool:
+    # The service clients wrap the requests errors, so the whole exception chain is checked
+    seen = []
+    while err and err not in seen:
+        if isinstance(err, (ConnectionError, Timeout, TimeoutError)):
+            return True
+        response = getattr(err, "response", None)
+        if response is not None and getattr(response, "status_code", 0) >= 500:
+            return True
+        seen.append(err)
+        err = err.__cause__ or err.__context__
+    return False
+
+
+class CircuitBreaker:
+    """Stops requests to a service after too many consecutive outages.
+
+    Once a service fails threshold times in a row its requests are refused for the cooldown, after
+    which a single request is let through and another failure refuses them again.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]]):
+        self.limits = limits
+        self.failures = Counter()
+        self.opened: Dict[str, float] = {}
+        self.skipped = Counter()
+        self.tripped = Counter()
+        self.lock = Lock()
+
+    def check(self, service: Optional[str]):
+        if service not in self.limits:
+            return
+        with self.lock:
+            if (until := self.opened.get(service)) is None:
+                return
+            if (remaining := until - time.monotonic()) > 0:
+                self.skipped[service] += 1
+                raise ServiceUnavailable(service, f"skipped for another {remaining:.0f}s")
+            del self.opened[service]
+            self.failures[service] = self.limits[service][0] - 1
+
+    def success(self, service: Optional[str]):
+        with self.lock:
+            self.failures.pop(service, None)
+
+    def failure(self, service: Optional[str], err: BaseException):
+        if service not in self.limits:
+            return
+        threshold, cooldown = self.limits[service]
+        with self.lock:
+            self.failures[service] += 1
+            if self.failures[service] < threshold:
+                return
+            self.opened[service] = time.monotonic() + cooldown
+            self.tripped[service] += 1
+        CONSOLE.print(
+            f"{service} failed {threshold} times in a row, skipping it for {cooldown:.0f}s: {err}",
+            style="logging.level.warning",
+        )
+
+    def __str__(self):
+        return "Circuit breaker: " + ", ".join(
+            f"{x} tripped {self.tripped[x]} times, {self.skipped[x]} requests skipped"
+            for x in sorted({*self.tripped, *self.skipped})
+        )
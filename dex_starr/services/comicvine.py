@@ -1,6 +1,7 @@
 __all__ = ["SimyanTalker"]
 
-from typing import Optional
+from datetime import date
+from typing import Optional, Tuple
 
 from natsort import humansorted as sorted
 from natsort import ns
@@ -22,13 +23,45 @@
     Series,
     StoryArc,
 )
+from dex_starr.services.id_index import IdIndex
+from dex_starr.services.issue_prefetch import IssuePrefetch
+from dex_starr.services.match_scorer import MatchScorer
+from dex_starr.services.resolution_memo import ResolutionMemo
 from dex_starr.services.sqlite_cache import SQLiteCache
 from dex_starr.settings import ComicvineSettings
 
 
 class SimyanTalker:
-    def __init__(self, settings: ComicvineSettings):
-        self.session = Comicvine(api_key=settings.api_key, cache=SQLiteCache(expiry=14))
+    FIELDS = {
+        "issue.characters",
+        "issue.cover_date",
+        "issue.creators",
+        "issue.locations",
+        "issue.number",
+        "issue.store_date",
+        "issue.story_arcs",
+        "issue.summary",
+        "issue.teams",
+        "issue.title",
+        "publisher.title",
+        "series.start_year",
+        "series.title",
+    }
+
+    def __init__(
+        self,
+        settings: ComicvineSettings,
+        cache: SQLiteCache,
+        memo: Optional[ResolutionMemo] = None,
+        ids: Optional[IdIndex] = None,
+        scorer: Optional[MatchScorer] = None,
+    ):
+        self.cache = cache
+        self.memo = memo or ResolutionMemo()
+        self.ids = ids or IdIndex()
+        self.prefetch = IssuePrefetch()
+        self.scorer = scorer or MatchScorer()
+        self.session = Comicvine(api_key=settings.api_key, timeout=settings.timeout, cache=cache)
 
     def update_issue(self, result: SimyanIssue, issue: Issue):
         if result.characters or result.first_appearance_characters or result.deaths:
@@ -101,39 +134,62 @@ def update_issue(self, result: SimyanIssue, issue: Issue):
     def _select_issue(self, issue_id: int) -> Optional[SimyanIssue]:
         CONSOLE.print(f"Getting Issue: {issue_id=}", style="logging.level.debug")
         try:
-            return self.session.issue(issue_id)
+            return self.cache.fetch(self.session.issue, issue_id)
         except ServiceError:
             CONSOLE.print(f"Unable to get Issue: {issue_id=}", style="logging.level.warning")
         return None
 
-    def _search_issue(self, series_id: int, number: str) -> Optional[SimyanIssue]:
+    def _search_issue(
+        self,
+        series_id: int,
+        number: str,
+        cover_date: Optional[date] = None,
+        interactive: bool = True,
+    ) -> Optional[SimyanIssue]:
         CONSOLE.print(f"Searching for Issue: {series_id=}, {number=}", style="logging.level.debug")
         output = None
+        issue_list = None
         try:
-            issue_list = self.session.issue_list(
-                {"filter": f"volume:{series_id},issue_number:{number}"}
+            issue_list = self.prefetch.search(
+                series_id,
+                number,
+                lambda: self.cache.fetch(
+                    self.session.issue_list, {"filter": f"volume:{series_id}"}
+                ),
+                key=lambda x: x.number,
             )
         except ServiceError:
-            issue_list = []
-        if issue_list := sorted(issue_list, key=lambda i: i.number, alg=ns.NA | ns.G):
-            issue_index = create_menu(
-                options=[f"{i.issue_id} | {i.volume.name} #{i.number}" for i in issue_list],
-                prompt="Select Issue",
-                default="None of the Above",
-            )
-            if issue_index != 0:
-                output = self._select_issue(issue_list[issue_index - 1].issue_id)
+            CONSOLE.print(f"Unable to list Issues: {series_id=}", style="logging.level.debug")
+        if not issue_list:
+            try:
+                issue_list = self.cache.fetch(
+                    self.session.issue_list,
+                    {"filter": f"volume:{series_id},issue_number:{number}"},
+                )
+            except ServiceError:
+                issue_list = []
+        if selected := self.scorer.select(
+            target={"number": number, "cover_date": cover_date},
+            candidates=sorted(issue_list, key=lambda i: i.number, alg=ns.NA | ns.G),
+            fields=lambda i: {"number": i.number, "cover_date": i.cover_date},
+            describe=lambda i: f"{i.issue_id} | {i.volume.name} #{i.number}",
+            prompt="Select Issue",
+            interactive=interactive,
+        ):
+            output = self._select_issue(selected.issue_id)
         return output
 
-    def lookup_issue(self, issue: Issue, series_id: int) -> Optional[SimyanIssue]:
+    def lookup_issue(
+        self, issue: Issue, series_id: int, interactive: bool = True
+    ) -> Optional[SimyanIssue]:
         output = None
-        source_list = [x.source for x in issue.resources]
-        if Source.COMICVINE in source_list:
-            index = source_list.index(Source.COMICVINE)
-            output = self._select_issue(issue.resources[index].value)
+        if issue_id := self.ids.resolve("issue", issue.resources, Source.COMICVINE):
+            output = self._select_issue(issue_id)
         if not output:
-            output = self._search_issue(series_id, issue.number)
-        while not output:
+            output = self._search_issue(
+                series_id, issue.number, issue.cover_date, interactive=interactive
+            )
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Issue id", "Enter Issue number"], prompt="Select", default="Exit"
             )
@@ -160,13 +216,17 @@ def update_series(self, result: Volume, series: Series):
     def _select_volume(self, volume_id: int) -> Optional[Volume]:
         CONSOLE.print(f"Getting Volume: {volume_id=}", style="logging.level.debug")
         try:
-            return self.session.volume(volume_id)
+            return self.cache.fetch(self.session.volume, volume_id)
         except ServiceError:
             CONSOLE.print(f"Unable to get Volume: {volume_id=}", style="logging.level.warning")
         return None
 
     def _search_volume(
-        self, publisher_id: int, title: str, start_year: Optional[int] = None
+        self,
+        publisher_id: int,
+        title: str,
+        start_year: Optional[int] = None,
+        interactive: bool = True,
     ) -> Optional[Volume]:
         CONSOLE.print(
             f"Searching for Volume: {publisher_id=}, {title=}, {start_year=}",
@@ -174,7 +234,7 @@ def _search_volume(
         )
         output = None
         try:
-            volume_list = self.session.volume_list({"filter": f"name:{title}"})
+            volume_list = self.cache.fetch(self.session.volume_list, {"filter": f"name:{title}"})
         except ServiceError:
             volume_list = []
         volume_list = filter(
@@ -182,29 +242,36 @@ def _search_volume(
         )
         if start_year:
             volume_list = filter(lambda v: v.start_year == start_year, volume_list)
-        if volume_list := sorted(
-            volume_list, key=lambda v: (v.name, v.start_year or 0), alg=ns.NA | ns.G
+        if selected := self.scorer.select(
+            target={"title": title, "start_year": start_year},
+            candidates=sorted(
+                volume_list, key=lambda v: (v.name, v.start_year or 0), alg=ns.NA | ns.G
+            ),
+            fields=lambda v: {"title": v.name, "start_year": v.start_year},
+            describe=lambda v: f"{v.volume_id} | {v.name} ({v.start_year})",
+            prompt="Select Volume",
+            interactive=interactive,
         ):
-            volume_index = create_menu(
-                options=[f"{v.volume_id} | {v.name} ({v.start_year})" for v in volume_list],
-                prompt="Select Volume",
-                default="None of the Above",
-            )
-            if volume_index != 0:
-                output = self._select_volume(volume_list[volume_index - 1].volume_id)
+            output = self._select_volume(selected.volume_id)
         if not output and start_year:
-            return self._search_volume(publisher_id, title)
+            return self._search_volume(publisher_id, title, interactive=interactive)
         return output
 
-    def lookup_volume(self, series: Series, publisher_id: int) -> Optional[Volume]:
+    def lookup_volume(
+        self, series: Series, publisher_id: int, interactive: bool = True
+    ) -> Optional[Volume]:
         output = None
-        source_list = [x.source for x in series.resources]
-        if Source.COMICVINE in source_list:
-            index = source_list.index(Source.COMICVINE)
-            output = self._select_volume(series.resources[index].value)
+        if volume_id := self.ids.resolve("series", series.resources, Source.COMICVINE):
+            output = self._select_volume(volume_id)
+        if not output:
+            output = self.memo.get_series(
+                Source.COMICVINE, publisher_id, series.title, start_year=series.start_year
+            )
         if not output:
-            output = self._search_volume(publisher_id, series.title, series.start_year)
-        while not output:
+            output = self._search_volume(
+                publisher_id, series.title, series.start_year, interactive=interactive
+            )
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Volume id", "Enter Volume title"], prompt="Select", default="Exit"
             )
@@ -216,6 +283,9 @@ def lookup_volume(self, series: Series, publisher_id: int) -> Optional[Volume]:
             else:
                 volume_title = Prompt.ask("Volume title", console=CONSOLE)
                 output = self._search_volume(publisher_id, volume_title)
+        self.memo.put_series(
+            Source.COMICVINE, publisher_id, series.title, output, start_year=series.start_year
+        )
         return output
 
     def update_publisher(self, result: SimyanPublisher, publisher: Publisher):
@@ -229,41 +299,46 @@ def update_publisher(self, result: SimyanPublisher, publisher: Publisher):
     def _select_publisher(self, publisher_id: int) -> Optional[Publisher]:
         CONSOLE.print(f"Getting Publisher: {publisher_id=}", style="logging.level.debug")
         try:
-            return self.session.publisher(publisher_id)
+            return self.cache.fetch(self.session.publisher, publisher_id)
         except ServiceError:
             CONSOLE.print(
                 f"Unable to get Publisher: {publisher_id=}", style="logging.level.warning"
             )
         return None
 
-    def _search_publisher(self, title: str) -> Optional[SimyanPublisher]:
+    def _search_publisher(self, title: str, interactive: bool = True) -> Optional[SimyanPublisher]:
         CONSOLE.print(f"Searching for Publisher: {title=}", style="logging.level.debug")
         output = None
         try:
-            publisher_list = self.session.publisher_list({"filter": f"name:{title}"})
+            publisher_list = self.cache.fetch(
+                self.session.publisher_list, {"filter": f"name:{title}"}
+            )
         except ServiceError:
             publisher_list = []
-        if publisher_list := sorted(publisher_list, key=lambda p: p.name, alg=ns.NA | ns.G):
-            publisher_index = create_menu(
-                options=[f"{p.publisher_id} | {p.name}" for p in publisher_list],
-                prompt="Select Publisher",
-                default="None of the Above",
-            )
-            if publisher_index != 0:
-                output = self._select_publisher(publisher_list[publisher_index - 1].publisher_id)
+        if selected := self.scorer.select(
+            target={"title": title},
+            candidates=sorted(publisher_list, key=lambda p: p.name, alg=ns.NA | ns.G),
+            fields=lambda p: {"title": p.name},
+            describe=lambda p: f"{p.publisher_id} | {p.name}",
+            prompt="Select Publisher",
+            interactive=interactive,
+        ):
+            output = self._select_publisher(selected.publisher_id)
         return output
 
-    def lookup_publisher(self, publisher: Publisher) -> Optional[SimyanPublisher]:
+    def lookup_publisher(
+        self, publisher: Publisher, interactive: bool = True
+    ) -> Optional[SimyanPublisher]:
         output = None
-        source_list = [x.source for x in publisher.resources]
-        if Source.COMICVINE in source_list:
-            index = source_list.index(Source.COMICVINE)
-            output = self._select_publisher(publisher.resources[index].value)
+        if publisher_id := self.ids.resolve("publisher", publisher.resources, Source.COMICVINE):
+            output = self._select_publisher(publisher_id)
+        if not output:
+            output = self.memo.get_publisher(Source.COMICVINE, publisher.title)
         if not output:
-            output = self._search_publisher(publisher.title)
+            output = self._search_publisher(publisher.title, interactive=interactive)
         if not output and publisher.title.startswith("Marvel"):
-            output = self._search_publisher("Marvel")
-        while not output:
+            output = self._search_publisher("Marvel", interactive=interactive)
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Publisher id", "Enter Publisher title"],
                 prompt="Select",
@@ -277,10 +352,74 @@ def lookup_publisher(self, publisher: Publisher) -> Optional[SimyanPublisher]:
             else:
                 publisher_title = Prompt.ask("Publisher title", console=CONSOLE)
                 output = self._search_publisher(publisher_title)
+        self.memo.put_publisher(Source.COMICVINE, publisher.title, output)
         return output
 
+    def _lookup_known_issue(
+        self, metadata: Metadata
+    ) -> Optional[Tuple[None, Optional[Volume], SimyanIssue]]:
+        if not (issue_id := self.ids.resolve("issue", metadata.issue.resources, Source.COMICVINE)):
+            return None
+        if not (issue := self._select_issue(issue_id)):
+            return None
+        # Issues only reference their volume by id and name, the volume details (which name the
+        # publisher) are only needed when the start year or publisher are still missing
+        volume = None
+        if not metadata.series.start_year or Source.COMICVINE not in [
+            x.source for x in metadata.publisher.resources
+        ]:
+            volume = self._select_volume(issue.volume.id_)
+        return None, volume, issue
+
+    def resolve_metadata(
+        self, metadata: Metadata
+    ) -> Optional[Tuple[Optional[SimyanPublisher], Optional[Volume], SimyanIssue]]:
+        if results := self._lookup_known_issue(metadata):
+            return results
+        if publisher := self.lookup_publisher(metadata.publisher, interactive=False):
+            if volume := self.lookup_volume(
+                metadata.series, publisher.publisher_id, interactive=False
+            ):
+                if issue := self.lookup_issue(metadata.issue, volume.volume_id, interactive=False):
+                    return publisher, volume, issue
+        return None
+
+    def apply_metadata(
+        self,
+        results: Tuple[Optional[SimyanPublisher], Optional[Volume], SimyanIssue],
+        metadata: Metadata,
+    ):
+        publisher, volume, issue = results
+        if publisher:
+            self.update_publisher(publisher, metadata.publisher)
+        elif volume and volume.publisher:
+            metadata.publisher.resources = sorted(
+                {
+                    Resource(source=Source.COMICVINE, value=volume.publisher.id_),
+                    *metadata.publisher.resources,
+                },
+                alg=ns.NA | ns.G,
+            )
+            if volume.publisher.name:
+                metadata.publisher.title = volume.publisher.name
+        if volume:
+            self.update_series(volume, metadata.series)
+        else:
+            metadata.series.resources = sorted(
+                {
+                    Resource(source=Source.COMICVINE, value=issue.volume.id_),
+                    *metadata.series.resources,
+                },
+                alg=ns.NA | ns.G,
+            )
+            if issue.volume.name:
+                metadata.series.title = issue.volume.name
+        self.update_issue(issue, metadata.issue)
+
     def update_metadata(self, metadata: Metadata):
-        if publisher := self.lookup_publisher(metadata.publisher):
+        if results := self._lookup_known_issue(metadata):
+            self.apply_metadata(results, metadata)
+        elif publisher := self.lookup_publisher(metadata.publisher):
             self.update_publisher(publisher, metadata.publisher)
             if volume := self.lookup_volume(metadata.series, publisher.publisher_id):
                 self.update_series(volume, metadata.series)
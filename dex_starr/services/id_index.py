@@ -0,0 +1,117 @@
+__all__ = ["IdIndex"]
+
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from dex_starr.models.metadata.enums import Source
+from dex_starr.models.metadata.schema import Metadata, Resource
+
+
+class IdIndex:
+    """Which ids on the different services belong to the same publisher, series or issue.
+
+    Entries are linked from service responses that name ids on other services and from every
+    archive written, so an id known from one service can be selected directly on the others.
+    Kept in memory only when no path is given. An index with a parent also finds the parent's
+    ids, but only links them, and counts what it found, in the parent on commit.
+    """
+
+    def __init__(self, path: Optional[Path] = None, parent: Optional["IdIndex"] = None):
+        self.parent = parent
+        self.links: List[Tuple[str, Dict[Source, Optional[int]]]] = []
+        self.lock = Lock()
+        self.con = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode = WAL;")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS ids (kind, source, id INTEGER, entity INTEGER, "
+            "PRIMARY KEY (kind, source, id));"
+        )
+        self.con.execute("CREATE INDEX IF NOT EXISTS ids_entity ON ids (entity);")
+        self.con.commit()
+        self.found = 0
+
+    def link(self, kind: str, ids: Dict[Source, Optional[int]]):
+        ids = {k: v for k, v in ids.items() if v}
+        if len(ids) < 2:
+            return
+        with self.lock:
+            if self.parent:
+                self.links.append((kind, ids))
+            entities = set()
+            for source, id_ in ids.items():
+                entities.update(
+                    x
+                    for (x,) in self.con.execute(
+                        "SELECT entity FROM ids WHERE kind = ? AND source = ? AND id = ?;",
+                        (kind, source.value, id_),
+                    )
+                )
+            if entities:
+                entity = min(entities)
+                self.con.executemany(
+                    "UPDATE ids SET entity = ? WHERE entity = ?;",
+                    [(entity, x) for x in entities if x != entity],
+                )
+            else:
+                entity = self.con.execute(
+                    "SELECT COALESCE(MAX(entity), 0) + 1 FROM ids;"
+                ).fetchone()[0]
+            self.con.executemany(
+                "INSERT OR IGNORE INTO ids (kind, source, id, entity) VALUES (?, ?, ?, ?);",
+                [(kind, source.value, id_, entity) for source, id_ in ids.items()],
+            )
+            self.con.commit()
+
+    def link_resources(self, kind: str, resources: List[Resource]):
+        self.link(kind=kind, ids={x.source: x.value for x in resources})
+
+    def link_metadata(self, metadata: Metadata):
+        self.link_resources("publisher", metadata.publisher.resources)
+        self.link_resources("series", metadata.series.resources)
+        self.link_resources("issue", metadata.issue.resources)
+
+    def find(self, kind: str, resources: List[Resource], source: Source) -> Optional[int]:
+        if (output := self._find(kind, resources, source)) is not None:
+            with self.lock:
+                self.found += 1
+        return output
+
+    def _find(self, kind: str, resources: List[Resource], source: Source) -> Optional[int]:
+        with self.lock:
+            for resource in resources:
+                if resource.source == source:
+                    continue
+                if row := self.con.execute(
+                    "SELECT b.id FROM ids AS a JOIN ids AS b ON a.entity = b.entity "
+                    "AND a.kind = b.kind WHERE a.kind = ? AND a.source = ? AND a.id = ? "
+                    "AND b.source = ? ORDER BY b.id;",
+                    (kind, resource.source.value, resource.value, source.value),
+                ).fetchone():
+                    return row[0]
+        if self.parent:
+            return self.parent._find(kind, resources, source)
+        return None
+
+    def resolve(self, kind: str, resources: List[Resource], source: Source) -> Optional[int]:
+        for resource in resources:
+            if resource.source == source:
+                return resource.value
+        return self.find(kind=kind, resources=resources, source=source)
+
+    def commit(self):
+        with self.lock:
+            links, self.links = self.links, []
+            found, self.found = self.found, 0
+        for kind, ids in links:
+            self.parent.link(kind=kind, ids=ids)
+        with self.parent.lock:
+            self.parent.found += found
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+    def __str__(self):
+        return f"Id index: {self.found} ids found from other services"
@@ -0,0 +1,60 @@
+__all__ = ["IssuePrefetch"]
+
+from collections import Counter, defaultdict
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+from dex_starr.services.match_scorer import normalize_number
+
+
+class IssuePrefetch:
+    """Answers issue searches from the full issue list of series searched more than once.
+
+    Imports usually bring in many issues of the same series, so once threshold issues of a series
+    have been searched for its whole issue list is fetched and the later searches are answered from
+    it. Numbers are compared without leading zeros, and numbers missing from the list are left to
+    the regular search. A prefetch with a parent shares its issue lists, but only adds its searches
+    to the parent's on commit.
+    """
+
+    def __init__(self, threshold: int = 2, parent: Optional["IssuePrefetch"] = None):
+        self.parent = parent
+        self.threshold = parent.threshold if parent else threshold
+        self.searches = Counter()
+        self.issues: Dict[int, List[Any]] = parent.issues if parent else {}
+        self.answered = 0
+        self.lock = parent.lock if parent else Lock()
+        # Held while a series' list is fetched, so it is only fetched once
+        self.series_locks: Dict[int, Lock] = parent.series_locks if parent else defaultdict(Lock)
+
+    def search(
+        self,
+        series_id: int,
+        number: str,
+        fetch_all: Callable[[], List[Any]],
+        key: Callable[[Any], Any],
+    ) -> Optional[List[Any]]:
+        with self.lock:
+            self.searches[series_id] += 1
+            searches = self.searches[series_id]
+            if self.parent:
+                searches += self.parent.searches[series_id]
+            if searches < self.threshold:
+                return None
+            series_lock = self.series_locks[series_id]
+        with series_lock:
+            if series_id not in self.issues:
+                self.issues[series_id] = list(fetch_all())
+        number = normalize_number(number)
+        if output := [x for x in self.issues[series_id] if normalize_number(key(x)) == number]:
+            with self.lock:
+                self.answered += 1
+        return output or None
+
+    def commit(self):
+        # Shares the parent's lock
+        with self.lock:
+            self.parent.searches.update(self.searches)
+            self.parent.answered += self.answered
+            self.searches.clear()
+            self.answered = 0
@@ -1,7 +1,8 @@
 __all__ = ["HimonTalker"]
 
 import html
-from typing import List, Optional, Tuple
+import re
+from typing import Any, Dict, List, Optional, Tuple
 
 from himon.exceptions import ServiceError
 from himon.league_of_comic_geeks import LeagueofComicGeeks
@@ -14,10 +15,24 @@
 from dex_starr.console import CONSOLE, create_menu
 from dex_starr.models.metadata.enums import Format, Role, Source
 from dex_starr.models.metadata.schema import Creator, Issue, Metadata, Publisher, Resource, Series
+from dex_starr.services.id_index import IdIndex
+from dex_starr.services.match_scorer import MatchScorer
 from dex_starr.services.sqlite_cache import SQLiteCache
 from dex_starr.settings import LeagueOfComicGeeksSettings
 
 
+def comic_fields(result: Comic) -> Dict[str, Any]:
+    number = re.search(r"#(\S+)", result.title)
+    return {
+        "title": result.series_name,
+        "number": number.group(1) if number else None,
+        "volume": result.series_volume,
+        "start_year": result.year_begin,
+        "publisher": result.publisher_name,
+        "cover_date": result.release_date,
+    }
+
+
 def generate_search_terms(
     series_title: str, number: Optional[str] = None
 ) -> Tuple[str, Optional[str], Optional[str], Optional[str], Optional[str]]:
@@ -32,12 +47,36 @@ def generate_search_terms(
 
 
 class HimonTalker:
-    def __init__(self, settings: LeagueOfComicGeeksSettings):
+    FIELDS = {
+        "issue.characters",
+        "issue.cover_date",
+        "issue.creators",
+        "issue.format",
+        "issue.page_count",
+        "issue.summary",
+        "issue.title",
+        "publisher.title",
+        "series.start_year",
+        "series.title",
+        "series.volume",
+    }
+
+    def __init__(
+        self,
+        settings: LeagueOfComicGeeksSettings,
+        cache: SQLiteCache,
+        ids: Optional[IdIndex] = None,
+        scorer: Optional[MatchScorer] = None,
+    ):
+        self.cache = cache
+        self.ids = ids or IdIndex()
+        self.scorer = scorer or MatchScorer()
         self.session = LeagueofComicGeeks(
             client_id=settings.client_id,
             client_secret=settings.client_secret,
             access_token=settings.access_token,
-            cache=SQLiteCache(expiry=14),
+            timeout=settings.timeout,
+            cache=cache,
         )
         if not settings.access_token:
             CONSOLE.print("Generating new access token", style="logging.level.info")
@@ -108,34 +147,43 @@ def update_publisher(self, result: HimonSeries, publisher: Publisher):
         if result.publisher_name:
             publisher.title = result.publisher_name
 
-    def _filter_format(self, results: List[Comic]) -> List[Comic]:
+    def _filter_format(self, results: List[Comic], interactive: bool = True) -> List[Comic]:
         format_list = sorted({x.format for x in results}, alg=ns.NA | ns.G)
         if len(format_list) == 1:
             return results
         index = create_menu(
-            options=format_list, prompt="Filter by format", default="None of the Above"
+            options=format_list,
+            prompt="Filter by format",
+            default="None of the Above",
+            interactive=interactive,
         )
         if index == 0:
             return results
         return [x for x in results if x.format == format_list[index - 1]]
 
-    def _filter_series(self, results: List[Comic]) -> List[Comic]:
+    def _filter_series(self, results: List[Comic], interactive: bool = True) -> List[Comic]:
         series_list = sorted({x.series_name for x in results}, alg=ns.NA | ns.G)
         if len(series_list) == 1:
             return results
         index = create_menu(
-            options=series_list, prompt="Filter by series", default="None of the Above"
+            options=series_list,
+            prompt="Filter by series",
+            default="None of the Above",
+            interactive=interactive,
         )
         if index == 0:
             return results
         return [x for x in results if x.series_name == series_list[index - 1]]
 
-    def _filter_publisher(self, results: List[Comic]) -> List[Comic]:
+    def _filter_publisher(self, results: List[Comic], interactive: bool = True) -> List[Comic]:
         publisher_list = sorted({x.publisher_name for x in results}, alg=ns.NA | ns.G)
         if len(publisher_list) == 1:
             return results
         index = create_menu(
-            options=publisher_list, prompt="Filter by publisher", default="None of the above"
+            options=publisher_list,
+            prompt="Filter by publisher",
+            default="None of the above",
+            interactive=interactive,
         )
         if index == 0:
             return results
@@ -144,7 +192,7 @@ def _filter_publisher(self, results: List[Comic]) -> List[Comic]:
     def _select_comic(self, comic_id: int) -> Optional[Comic]:
         CONSOLE.print(f"Getting Comic: {comic_id=}", style="logging.level.debug")
         try:
-            return self.session.comic(comic_id)
+            return self.cache.fetch(self.session.comic, comic_id)
         except ServiceError:
             CONSOLE.print(f"Unable to get Comic: {comic_id=}", style="logging.level.warning")
         return None
@@ -153,48 +201,66 @@ def _search_comic(
         self,
         title: str,
         number: Optional[str] = None,
+        target: Optional[Dict[str, Any]] = None,
+        interactive: bool = True,
     ) -> Optional[Comic]:
         CONSOLE.print(f"Searching for Comic: {title=}, {number=}", style="logging.level.debug")
         output = None
         results = []
-        for search_term in generate_search_terms(title, number):
-            if not search_term:
-                continue
-            try:
-                results.extend(x for x in self.session.search(search_term) if not x.is_variant)
-            except ServiceError:
-                pass
+        search_terms = [x for x in generate_search_terms(title, number) if x]
+        # An exact title match for the plain issue search ends the format searches early
+        for _, search_results in self.cache.fetch_each(
+            self.session.search, [(x,) for x in search_terms], ignore=(ServiceError,)
+        ):
+            results.extend(x for x in search_results if not x.is_variant)
+            if strong := [x for x in results if x.title.casefold() == search_terms[0].casefold()]:
+                results = strong
+                break
         comic_list = list({x.comic_id: x for x in results}.values())
-        comic_list = self._filter_publisher(results=comic_list)
-        comic_list = self._filter_series(results=comic_list)
-        comic_list = self._filter_format(results=comic_list)
-        if comic_list := sorted(
-            comic_list,
-            key=lambda x: (x.publisher_name, x.series_name, x.series_volume or 1, x.title),
-            alg=ns.NA | ns.G,
+        target = {"title": title, "number": number, **(target or {})}
+        # The filters only need asking when the results aren't already a clear match
+        if self.scorer.confident(ranked := self.scorer.rank(target, comic_list, comic_fields)):
+            comic_list = [ranked[0][1]]
+        comic_list = self._filter_publisher(results=comic_list, interactive=interactive)
+        comic_list = self._filter_series(results=comic_list, interactive=interactive)
+        comic_list = self._filter_format(results=comic_list, interactive=interactive)
+        if selected := self.scorer.select(
+            target=target,
+            candidates=sorted(
+                comic_list,
+                key=lambda x: (x.publisher_name, x.series_name, x.series_volume or 1, x.title),
+                alg=ns.NA | ns.G,
+            ),
+            fields=comic_fields,
+            describe=lambda x: (
+                f"{x.comic_id} | {x.publisher_name} | {x.series_name} v{x.series_volume or 1} "
+                f"| {x.title}"
+            ),
+            prompt="Select Comic",
+            interactive=interactive,
         ):
-            comic_index = create_menu(
-                options=[
-                    f"{x.comic_id} | {x.publisher_name} | {x.series_name} v{x.series_volume or 1} "
-                    f"| {x.title}"
-                    for x in comic_list
-                ],
-                prompt="Select Comic",
-                default="None of the Above",
-            )
-            if comic_index != 0:
-                output = self._select_comic(comic_list[comic_index - 1].comic_id)
+            output = self._select_comic(selected.comic_id)
         return output
 
-    def lookup_comic(self, metadata: Metadata) -> Optional[Comic]:
+    def lookup_comic(self, metadata: Metadata, interactive: bool = True) -> Optional[Comic]:
         output = None
-        source_list = [x.source for x in metadata.issue.resources]
-        if Source.LEAGUE_OF_COMIC_GEEKS in source_list:
-            index = source_list.index(Source.LEAGUE_OF_COMIC_GEEKS)
-            output = self._select_comic(metadata.issue.resources[index].value)
+        if comic_id := self.ids.resolve(
+            "issue", metadata.issue.resources, Source.LEAGUE_OF_COMIC_GEEKS
+        ):
+            output = self._select_comic(comic_id)
         if not output:
-            output = self._search_comic(metadata.series.title, metadata.issue.number)
-        while not output:
+            output = self._search_comic(
+                metadata.series.title,
+                metadata.issue.number,
+                target={
+                    "volume": metadata.series.volume,
+                    "start_year": metadata.series.start_year,
+                    "publisher": metadata.publisher.title,
+                    "cover_date": metadata.issue.store_date or metadata.issue.cover_date,
+                },
+                interactive=interactive,
+            )
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Comic id", "Enter Search term"], prompt="Select", default="Exit"
             )
@@ -208,6 +274,14 @@ def lookup_comic(self, metadata: Metadata) -> Optional[Comic]:
                 output = self._search_comic(search)
         return output
 
+    def resolve_metadata(self, metadata: Metadata) -> Optional[Comic]:
+        return self.lookup_comic(metadata, interactive=False)
+
+    def apply_metadata(self, results: Comic, metadata: Metadata):
+        self.update_publisher(results.series, metadata.publisher)
+        self.update_series(results.series, metadata.series)
+        self.update_issue(results, metadata.issue)
+
     def update_metadata(self, metadata: Metadata):
         if comic := self.lookup_comic(metadata):
             self.update_publisher(comic.series, metadata.publisher)
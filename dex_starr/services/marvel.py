@@ -1,7 +1,7 @@
 __all__ = ["EsakTalker"]
 
 import re
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from esak.comic import Comic
 from esak.exceptions import ApiError
@@ -14,6 +14,10 @@
 from dex_starr.console import CONSOLE, create_menu
 from dex_starr.models.metadata.enums import Format, Role, Source
 from dex_starr.models.metadata.schema import Creator, Issue, Metadata, Resource, Series, StoryArc
+from dex_starr.services.id_index import IdIndex
+from dex_starr.services.issue_prefetch import IssuePrefetch
+from dex_starr.services.match_scorer import MatchScorer
+from dex_starr.services.resolution_memo import ResolutionMemo
 from dex_starr.services.sqlite_cache import SQLiteCache
 from dex_starr.settings import MarvelSettings
 
@@ -23,11 +27,37 @@ def clean_title(title: str) -> str:
 
 
 class EsakTalker:
-    def __init__(self, settings: MarvelSettings):
+    FIELDS = {
+        "issue.characters",
+        "issue.creators",
+        "issue.format",
+        "issue.number",
+        "issue.page_count",
+        "issue.store_date",
+        "issue.story_arcs",
+        "issue.summary",
+        "issue.title",
+        "series.start_year",
+        "series.title",
+    }
+
+    def __init__(
+        self,
+        settings: MarvelSettings,
+        cache: SQLiteCache,
+        memo: Optional[ResolutionMemo] = None,
+        ids: Optional[IdIndex] = None,
+        scorer: Optional[MatchScorer] = None,
+    ):
+        self.cache = cache
+        self.memo = memo or ResolutionMemo()
+        self.ids = ids or IdIndex()
+        self.prefetch = IssuePrefetch()
+        self.scorer = scorer or MatchScorer()
         self.session = Esak(
             public_key=settings.public_key,
             private_key=settings.private_key,
-            cache=SQLiteCache(expiry=14),
+            cache=cache,
         )
 
     def update_issue(self, result: Comic, issue: Issue):
@@ -69,41 +99,58 @@ def update_issue(self, result: Comic, issue: Issue):
     def _select_comic(self, comic_id: int) -> Optional[Comic]:
         CONSOLE.print(f"Getting Comic: {comic_id=}", style="logging.level.debug")
         try:
-            return self.session.comic(comic_id)
+            return self.cache.fetch(self.session.comic, comic_id)
         except ApiError:
             CONSOLE.print(f"Unable to get Comic: {comic_id=}", style="logging.level.warning")
         return None
 
-    def _search_comic(self, series_id: int, number: str) -> Optional[Comic]:
+    def _search_comic(
+        self, series_id: int, number: str, interactive: bool = True
+    ) -> Optional[Comic]:
         CONSOLE.print(f"Searching for Comic: {series_id=}, {number=}", style="logging.level.debug")
         output = None
         params = {"noVariants": True, "series": series_id, "issueNumber": number}
+        comic_list = None
         try:
-            comic_list = self.session.comics_list(params=params)
-        except ApiError:
-            comic_list = []
-        if comic_list := sorted(comic_list, key=lambda c: c.issue_number, alg=ns.NA | ns.G):
-            comic_index = create_menu(
-                options=[
-                    f"{c.id} | {clean_title(c.series.name)} #{c.issue_number} - {c.format}"
-                    for c in comic_list
-                ],
-                prompt="Select Comic",
-                default="None of the Above",
+            # The comics list isn't paged, a single page covers most series
+            comic_list = self.prefetch.search(
+                series_id,
+                number,
+                lambda: self.cache.fetch(
+                    self.session.comics_list,
+                    params={"noVariants": True, "series": series_id, "limit": 100},
+                ),
+                key=lambda x: x.issue_number,
             )
-            if comic_index != 0:
-                output = self._select_comic(comic_list[comic_index - 1].id)
+        except ApiError:
+            CONSOLE.print(f"Unable to list Comics: {series_id=}", style="logging.level.debug")
+        if not comic_list:
+            try:
+                comic_list = self.cache.fetch(self.session.comics_list, params=params)
+            except ApiError:
+                comic_list = []
+        if selected := self.scorer.select(
+            target={"number": number},
+            candidates=sorted(comic_list, key=lambda c: c.issue_number, alg=ns.NA | ns.G),
+            fields=lambda c: {"number": c.issue_number},
+            describe=lambda c: (
+                f"{c.id} | {clean_title(c.series.name)} #{c.issue_number} - {c.format}"
+            ),
+            prompt="Select Comic",
+            interactive=interactive,
+        ):
+            output = self._select_comic(selected.id)
         return output
 
-    def lookup_comic(self, issue: Issue, series_id: int) -> Optional[Comic]:
+    def lookup_comic(
+        self, issue: Issue, series_id: int, interactive: bool = True
+    ) -> Optional[Comic]:
         output = None
-        source_list = [x.source for x in issue.resources]
-        if Source.MARVEL in source_list:
-            index = source_list.index(Source.MARVEL)
-            output = self._select_comic(issue.resources[index].value)
+        if comic_id := self.ids.resolve("issue", issue.resources, Source.MARVEL):
+            output = self._select_comic(comic_id)
         if not output:
-            output = self._search_comic(series_id, issue.number)
-        while not output:
+            output = self._search_comic(series_id, issue.number, interactive=interactive)
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Comic id", "Enter Comic number"], prompt="Select", default="Exit"
             )
@@ -121,52 +168,93 @@ def update_series(self, result: EsakSeries, series: Series):
         series.resources = sorted(
             {Resource(source=Source.MARVEL, value=result.id), *series.resources}, alg=ns.NA | ns.G
         )
-        if result.start_year:
+        # Series embedded in a comic only carry their id and name
+        if getattr(result, "start_year", None):
             series.start_year = result.start_year
-        if result.title:
-            series.title = clean_title(result.title)
+        if title := getattr(result, "title", None) or getattr(result, "name", None):
+            series.title = clean_title(title)
 
     def _select_series(self, series_id: int) -> Optional[EsakSeries]:
         CONSOLE.print(f"Getting Series: {series_id=}", style="logging.level.debug")
         try:
-            return self.session.series(series_id)
+            return self.cache.fetch(self.session.series, series_id)
         except ApiError:
             CONSOLE.print(f"Unable to get Series: {series_id=}", style="logging.level.warning")
         return None
 
-    def _search_series(self, title: str, start_year: Optional[int] = None) -> Optional[EsakSeries]:
+    def _search_series(
+        self, title: str, start_year: Optional[int] = None, interactive: bool = True
+    ) -> Optional[EsakSeries]:
         CONSOLE.print(f"Searching for Series: {title=}, {start_year=}", style="logging.level.debug")
         output = None
-        params = {"title": title}
-        if start_year:
-            params["startYear"] = start_year
-        try:
-            series_list = self.session.series_list(params)
-        except ApiError:
-            series_list = []
-        if series_list := sorted(
-            series_list, key=lambda s: (s.title, s.start_year), alg=ns.NA | ns.G
+        # Same as Metron, a single series from the dated search ends the undated one early
+        searches = [{"title": title, "startYear": start_year}, {"title": title}]
+        if not start_year:
+            searches = searches[1:]
+        results = {}
+        strong = None
+        for index, series_list in self.cache.fetch_each(
+            self.session.series_list, [(x,) for x in searches], ignore=(ApiError,)
         ):
-            series_index = create_menu(
-                options=[f"{s.id} | {clean_title(s.title)} ({s.start_year})" for s in series_list],
+            results[index] = list(series_list)
+            found = next(
+                (results.get(i) for i in range(len(searches)) if results.get(i) != []), None
+            )
+            if found and len(found) == 1:
+                strong = found[0]
+                break
+        target = {"title": title, "start_year": start_year}
+
+        def fields(series: EsakSeries) -> Dict[str, Any]:
+            return {"title": clean_title(series.title), "start_year": series.start_year}
+
+        def choose(candidates: List[EsakSeries]) -> Optional[EsakSeries]:
+            return self.scorer.select(
+                target=target,
+                candidates=list({x.id: x for x in candidates}.values()),
+                fields=fields,
+                describe=lambda s: f"{s.id} | {clean_title(s.title)} ({s.start_year})",
                 prompt="Select Series",
-                default="None of the Above",
+                interactive=interactive,
             )
-            if series_index != 0:
-                output = self._select_series(series_list[series_index - 1].id)
-        if not output and start_year:
-            return self._search_series(title)
+
+        selected = None
+        if strong and (
+            interactive or self.scorer.confident(self.scorer.rank(target, [strong], fields))
+        ):
+            selected = choose([strong])
+        if not selected:
+            # Rejected or unsure, so the undated search abandoned for it is offered after all
+            missing = [i for i in range(len(searches)) if i not in results]
+            for index, series_list in self.cache.fetch_each(
+                self.session.series_list, [(searches[i],) for i in missing], ignore=(ApiError,)
+            ):
+                results[missing[index]] = list(series_list)
+            selected = choose(
+                [
+                    x
+                    for i in sorted(results)
+                    for x in sorted(
+                        results[i], key=lambda s: (s.title, s.start_year), alg=ns.NA | ns.G
+                    )
+                    if not (interactive and strong and x.id == strong.id)
+                ]
+            )
+        if selected:
+            output = self._select_series(selected.id)
         return output
 
-    def lookup_series(self, series: Series) -> Optional[EsakSeries]:
+    def lookup_series(self, series: Series, interactive: bool = True) -> Optional[EsakSeries]:
         output = None
-        source_list = [x.source for x in series.resources]
-        if Source.MARVEL in source_list:
-            index = source_list.index(Source.MARVEL)
-            output = self._select_series(series.resources[index].value)
+        if series_id := self.ids.resolve("series", series.resources, Source.MARVEL):
+            output = self._select_series(series_id)
         if not output:
-            output = self._search_series(series.title, series.start_year)
-        while not output:
+            output = self.memo.get_series(
+                Source.MARVEL, None, series.title, start_year=series.start_year
+            )
+        if not output:
+            output = self._search_series(series.title, series.start_year, interactive=interactive)
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Series id", "Enter Series title"], prompt="Select", default="Exit"
             )
@@ -178,12 +266,44 @@ def lookup_series(self, series: Series) -> Optional[EsakSeries]:
             else:
                 series_title = Prompt.ask("Series title", console=CONSOLE)
                 output = self._search_series(series_title)
+        self.memo.put_series(
+            Source.MARVEL, None, series.title, output, start_year=series.start_year
+        )
         return output
 
+    def _lookup_known_issue(self, metadata: Metadata) -> Optional[Tuple[EsakSeries, Comic]]:
+        if not (comic_id := self.ids.resolve("issue", metadata.issue.resources, Source.MARVEL)):
+            return None
+        if not (comic := self._select_comic(comic_id)):
+            return None
+        # Comics embed their series id and name, the series details are only needed when the
+        # start year is still missing
+        series = comic.series
+        if not metadata.series.start_year:
+            series = self._select_series(series.id) or series
+        return series, comic
+
+    def resolve_metadata(self, metadata: Metadata) -> Optional[Tuple[EsakSeries, Comic]]:
+        if not metadata.publisher.title.startswith("Marvel"):
+            return None
+        if results := self._lookup_known_issue(metadata):
+            return results
+        if series := self.lookup_series(metadata.series, interactive=False):
+            if comic := self.lookup_comic(metadata.issue, series.id, interactive=False):
+                return series, comic
+        return None
+
+    def apply_metadata(self, results: Tuple[EsakSeries, Comic], metadata: Metadata):
+        series, comic = results
+        self.update_series(series, metadata.series)
+        self.update_issue(comic, metadata.issue)
+
     def update_metadata(self, metadata: Metadata):
         if not metadata.publisher.title.startswith("Marvel"):
             return
-        if series := self.lookup_series(metadata.series):
+        if results := self._lookup_known_issue(metadata):
+            self.apply_metadata(results, metadata)
+        elif series := self.lookup_series(metadata.series):
             self.update_series(series, metadata.series)
             if comic := self.lookup_comic(metadata.issue, series.id):
                 self.update_issue(comic, metadata.issue)
@@ -0,0 +1,135 @@
+__all__ = ["MatchScorer", "normalize_title"]
+
+import re
+from datetime import date
+from difflib import SequenceMatcher
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from dex_starr.console import CONSOLE, create_menu
+
+T = TypeVar("T")
+WEIGHTS = {
+    "title": 3.0,
+    "number": 3.0,
+    "volume": 1.0,
+    "start_year": 1.0,
+    "cover_date": 1.0,
+    "publisher": 1.0,
+}
+
+
+@lru_cache(maxsize=4096)
+def normalize_title(title: str) -> str:
+    title = title.casefold().replace("&", " and ")
+    title = re.sub(r"\([^)]*\)|[^0-9a-z ]+", " ", title)
+    title = re.sub(r"^the ", "", " ".join(title.split()))
+    return title
+
+
+def normalize_number(number: Any) -> str:
+    return str(number).strip().casefold().lstrip("0") or "0"
+
+
+@lru_cache(maxsize=16384)
+def title_similarity(first: str, second: str) -> float:
+    first, second = normalize_title(first), normalize_title(second)
+    if first == second:
+        return 1.0
+    return SequenceMatcher(None, first, second).ratio()
+
+
+def date_proximity(first: date, second: date) -> float:
+    months = abs((first.year - second.year) * 12 + first.month - second.month)
+    return max(0.0, 1 - months / 12)
+
+
+class MatchScorer:
+    """Ranks search results against what is already known about the entity being looked for.
+
+    Titles and publishers are compared by similarity once normalized, numbers and volumes have to
+    be equal and years and cover dates score by how close they are. Only fields known on both sides
+    count. The best candidate is chosen without asking when it scores at least threshold and beats
+    the runner up by margin, anything else is left to the menu with the candidates sorted by score.
+    """
+
+    def __init__(
+        self, threshold: float = 0.9, margin: float = 0.1, parent: Optional["MatchScorer"] = None
+    ):
+        self.parent = parent
+        self.threshold = parent.threshold if parent else threshold
+        self.margin = parent.margin if parent else margin
+        self.chosen = 0
+        self.prompted = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def score(target: Dict[str, Any], candidate: Dict[str, Any]) -> float:
+        total = weights = 0.0
+        for field, weight in WEIGHTS.items():
+            if not (expected := target.get(field)) or not (actual := candidate.get(field)):
+                continue
+            if field in ["title", "publisher"]:
+                value = title_similarity(str(expected), str(actual))
+            elif field == "number":
+                value = float(normalize_number(expected) == normalize_number(actual))
+            elif field == "start_year":
+                value = max(0.0, 1 - abs(int(expected) - int(actual)) / 2)
+            elif field == "cover_date":
+                value = date_proximity(expected, actual)
+            else:
+                value = float(expected == actual)
+            total += value * weight
+            weights += weight
+        return total / weights if weights else 0.0
+
+    def rank(
+        self, target: Dict[str, Any], candidates: List[T], fields: Callable[[T], Dict[str, Any]]
+    ) -> List[Tuple[float, T]]:
+        ranked = [(self.score(target, fields(x)), x) for x in candidates]
+        return sorted(ranked, key=lambda x: x[0], reverse=True)
+
+    def confident(self, ranked: List[Tuple[float, T]]) -> bool:
+        if not ranked or ranked[0][0] < self.threshold:
+            return False
+        return len(ranked) == 1 or ranked[0][0] - ranked[1][0] >= self.margin
+
+    def select(
+        self,
+        target: Dict[str, Any],
+        candidates: List[T],
+        fields: Callable[[T], Dict[str, Any]],
+        describe: Callable[[T], str],
+        prompt: str,
+        interactive: bool = True,
+    ) -> Optional[T]:
+        if not (ranked := self.rank(target, candidates, fields)):
+            return None
+        if self.confident(ranked):
+            with self.lock:
+                self.chosen += 1
+            CONSOLE.print(
+                f"Matched {describe(ranked[0][1])} ({ranked[0][0]:.0%})",
+                style="logging.level.info",
+            )
+            return ranked[0][1]
+        options = [f"{describe(x)} ({score:.0%})" for score, x in ranked]
+        if not interactive:
+            # Below the threshold nothing is picked without asking, not even a lone candidate
+            create_menu(options=options, prompt=prompt, interactive=False)
+            return None
+        with self.lock:
+            self.prompted += 1
+        index = create_menu(options=options, prompt=prompt, default="None of the Above")
+        return ranked[index - 1][1] if index else None
+
+    def commit(self):
+        with self.lock:
+            chosen, prompted, self.chosen, self.prompted = self.chosen, self.prompted, 0, 0
+        with self.parent.lock:
+            self.parent.chosen += chosen
+            self.parent.prompted += prompted
+
+    def __str__(self):
+        return f"Match scoring: {self.chosen} chosen automatically, {self.prompted} asked"
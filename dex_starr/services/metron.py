@@ -1,7 +1,8 @@
 __all__ = ["MokkariTalker"]
 
 import html
-from typing import Optional
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
 
 from mokkari.exceptions import ApiError
 from mokkari.issue import Issue as MokkariIssue
@@ -23,15 +24,47 @@
     Series,
     StoryArc,
 )
+from dex_starr.services.id_index import IdIndex
+from dex_starr.services.issue_prefetch import IssuePrefetch
+from dex_starr.services.match_scorer import MatchScorer
+from dex_starr.services.resolution_memo import ResolutionMemo
 from dex_starr.services.sqlite_cache import SQLiteCache
 from dex_starr.settings import MetronSettings
 
 
 class MokkariTalker:
-    def __init__(self, settings: MetronSettings):
-        self.session = Mokkari(
-            username=settings.username, passwd=settings.password, cache=SQLiteCache(expiry=14)
-        )
+    FIELDS = {
+        "issue.characters",
+        "issue.cover_date",
+        "issue.creators",
+        "issue.format",
+        "issue.genres",
+        "issue.number",
+        "issue.store_date",
+        "issue.story_arcs",
+        "issue.summary",
+        "issue.teams",
+        "issue.title",
+        "publisher.title",
+        "series.start_year",
+        "series.title",
+        "series.volume",
+    }
+
+    def __init__(
+        self,
+        settings: MetronSettings,
+        cache: SQLiteCache,
+        memo: Optional[ResolutionMemo] = None,
+        ids: Optional[IdIndex] = None,
+        scorer: Optional[MatchScorer] = None,
+    ):
+        self.cache = cache
+        self.memo = memo or ResolutionMemo()
+        self.ids = ids or IdIndex()
+        self.prefetch = IssuePrefetch()
+        self.scorer = scorer or MatchScorer()
+        self.session = Mokkari(username=settings.username, passwd=settings.password, cache=cache)
 
     def update_issue(self, result: MokkariIssue, issue: Issue):
         if result.characters:
@@ -78,37 +111,68 @@ def update_issue(self, result: MokkariIssue, issue: Issue):
     def _select_issue(self, issue_id: int) -> Optional[MokkariIssue]:
         CONSOLE.print(f"Getting Issue: {issue_id=}", style="logging.level.debug")
         try:
-            return self.session.issue(issue_id)
+            result = self.cache.fetch(self.session.issue, issue_id)
+            # Metron names the matching Comicvine id
+            self.ids.link(
+                "issue",
+                {Source.METRON: result.id, Source.COMICVINE: getattr(result, "cv_id", None)},
+            )
+            return result
         except ApiError:
             CONSOLE.print(f"Unable to get Issue: {issue_id=}", style="logging.level.warning")
         return None
 
-    def _search_issue(self, series_id: int, number: str) -> Optional[MokkariIssue]:
+    def _search_issue(
+        self,
+        series_id: int,
+        number: str,
+        cover_date: Optional[date] = None,
+        interactive: bool = True,
+    ) -> Optional[MokkariIssue]:
         CONSOLE.print(f"Searching for Issue: {series_id=}, {number=}", style="logging.level.debug")
         output = None
+        issue_list = None
         try:
-            issue_list = self.session.issues_list({"series_id": series_id, "number": number})
-        except ApiError:
-            issue_list = []
-        if issue_list := sorted(issue_list, key=lambda i: i.issue_name, alg=ns.NA | ns.G):
-            issue_index = create_menu(
-                options=[f"{i.id} | {i.issue_name or i.collection_title}" for i in issue_list],
-                prompt="Select Issue",
-                default="None of the Above",
+            issue_list = self.prefetch.search(
+                series_id,
+                number,
+                lambda: self.cache.fetch(self.session.issues_list, {"series_id": series_id}),
+                key=lambda x: x.number,
             )
-            if issue_index != 0:
-                output = self._select_issue(issue_list[issue_index - 1].id)
+        except ApiError:
+            CONSOLE.print(f"Unable to list Issues: {series_id=}", style="logging.level.debug")
+        if not issue_list:
+            try:
+                issue_list = self.cache.fetch(
+                    self.session.issues_list, {"series_id": series_id, "number": number}
+                )
+            except ApiError:
+                issue_list = []
+        if selected := self.scorer.select(
+            target={"number": number, "cover_date": cover_date},
+            candidates=sorted(issue_list, key=lambda i: i.issue_name, alg=ns.NA | ns.G),
+            fields=lambda i: {
+                "number": getattr(i, "number", None),
+                "cover_date": getattr(i, "cover_date", None),
+            },
+            describe=lambda i: f"{i.id} | {i.issue_name or i.collection_title}",
+            prompt="Select Issue",
+            interactive=interactive,
+        ):
+            output = self._select_issue(selected.id)
         return output
 
-    def lookup_issue(self, issue: Issue, series_id: int) -> Optional[MokkariIssue]:
+    def lookup_issue(
+        self, issue: Issue, series_id: int, interactive: bool = True
+    ) -> Optional[MokkariIssue]:
         output = None
-        source_list = [x.source for x in issue.resources]
-        if Source.METRON in source_list:
-            index = source_list.index(Source.METRON)
-            output = self._select_issue(issue.resources[index].value)
+        if issue_id := self.ids.resolve("issue", issue.resources, Source.METRON):
+            output = self._select_issue(issue_id)
         if not output:
-            output = self._search_issue(series_id, issue.number)
-        while not output:
+            output = self._search_issue(
+                series_id, issue.number, issue.cover_date, interactive=interactive
+            )
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Issue id", "Enter Issue number"], prompt="Select", default="Exit"
             )
@@ -126,17 +190,23 @@ def update_series(self, result: MokkariSeries, series: Series):
         series.resources = sorted(
             {Resource(source=Source.METRON, value=result.id), *series.resources}, alg=ns.NA | ns.G
         )
-        if result.year_began:
+        # Series embedded in an issue only carry some of the fields
+        if getattr(result, "year_began", None):
             series.start_year = result.year_began
         if result.name:
             series.title = result.name
-        if result.volume:
+        if getattr(result, "volume", None):
             series.volume = result.volume
 
     def _select_series(self, series_id: int) -> Optional[MokkariSeries]:
         CONSOLE.print(f"Getting Series: {series_id=}", style="logging.level.debug")
         try:
-            return self.session.series(series_id)
+            result = self.cache.fetch(self.session.series, series_id)
+            self.ids.link(
+                "series",
+                {Source.METRON: result.id, Source.COMICVINE: getattr(result, "cv_id", None)},
+            )
+            return result
         except ApiError:
             CONSOLE.print(f"Unable to get Series: {series_id=}", style="logging.level.warning")
         return None
@@ -147,46 +217,99 @@ def _search_series(
         title: str,
         volume: Optional[int] = None,
         start_year: Optional[int] = None,
+        interactive: bool = True,
     ) -> Optional[MokkariSeries]:
         CONSOLE.print(
             f"Searching for Series: {publisher_id=}, {title=}, {volume=}, {start_year=}",
             style="logging.level.debug",
         )
         output = None
-        params = {"publisher_id": publisher_id, "name": title}
-        if volume:
-            params["volume"] = volume
-        if start_year:
-            params["start_year"] = start_year
-        try:
-            series_list = self.session.series_list(params)
-        except ApiError:
-            series_list = []
-        if series_list := sorted(series_list, key=lambda s: s.display_name, alg=ns.NA | ns.G):
-            series_index = create_menu(
-                options=[f"{s.id} | {s.display_name}" for s in series_list],
+        # Most specific first, a single series from the first search finding anything is a strong
+        # match and the looser searches still running are abandoned
+        searches = []
+        for extra in [
+            {"volume": volume, "start_year": start_year},
+            {"volume": volume},
+            {"start_year": start_year},
+        ]:
+            params = {"publisher_id": publisher_id, "name": title}
+            params.update({k: v for k, v in extra.items() if v})
+            if params not in searches:
+                searches.append(params)
+        results = {}
+        strong = None
+        for index, series_list in self.cache.fetch_each(
+            self.session.series_list, [(x,) for x in searches], ignore=(ApiError,)
+        ):
+            results[index] = list(series_list)
+            found = next(
+                (results.get(i) for i in range(len(searches)) if results.get(i) != []), None
+            )
+            if found and len(found) == 1:
+                strong = found[0]
+                break
+        target = {"title": title, "volume": volume, "start_year": start_year}
+
+        def fields(series: MokkariSeries) -> Dict[str, Any]:
+            return {
+                "title": series.display_name,
+                "volume": getattr(series, "volume", None),
+                "start_year": getattr(series, "year_began", None),
+            }
+
+        def choose(candidates: List[MokkariSeries]) -> Optional[MokkariSeries]:
+            return self.scorer.select(
+                target=target,
+                candidates=list({x.id: x for x in candidates}.values()),
+                fields=fields,
+                describe=lambda s: f"{s.id} | {s.display_name}",
                 prompt="Select Series",
-                default="None of the Above",
+                interactive=interactive,
             )
-            if series_index != 0:
-                output = self._select_series(series_list[series_index - 1].id)
-        if not output and start_year:
-            return self._search_series(publisher_id, title, volume=volume)
-        if not output and volume:
-            return self._search_series(publisher_id, title, start_year=start_year)
+
+        selected = None
+        if strong and (
+            interactive or self.scorer.confident(self.scorer.rank(target, [strong], fields))
+        ):
+            selected = choose([strong])
+        if not selected:
+            # Rejected or unsure, so the looser searches abandoned for it are offered after all
+            missing = [i for i in range(len(searches)) if i not in results]
+            for index, series_list in self.cache.fetch_each(
+                self.session.series_list, [(searches[i],) for i in missing], ignore=(ApiError,)
+            ):
+                results[missing[index]] = list(series_list)
+            selected = choose(
+                [
+                    x
+                    for i in sorted(results)
+                    for x in sorted(results[i], key=lambda s: s.display_name, alg=ns.NA | ns.G)
+                    if not (interactive and strong and x.id == strong.id)
+                ]
+            )
+        if selected:
+            output = self._select_series(selected.id)
         return output
 
-    def lookup_series(self, series: Series, publisher_id: int) -> Optional[MokkariSeries]:
+    def lookup_series(
+        self, series: Series, publisher_id: int, interactive: bool = True
+    ) -> Optional[MokkariSeries]:
         output = None
-        source_list = [x.source for x in series.resources]
-        if Source.METRON in source_list:
-            index = source_list.index(Source.METRON)
-            output = self._select_series(series.resources[index].value)
+        if series_id := self.ids.resolve("series", series.resources, Source.METRON):
+            output = self._select_series(series_id)
+        if not output:
+            output = self.memo.get_series(
+                Source.METRON, publisher_id, series.title, series.volume, series.start_year
+            )
         if not output:
             output = self._search_series(
-                publisher_id, series.title, series.volume, series.start_year
+                publisher_id,
+                series.title,
+                series.volume,
+                series.start_year,
+                interactive=interactive,
             )
-        while not output:
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Series id", "Enter Series title"], prompt="Select", default="Exit"
             )
@@ -198,6 +321,9 @@ def lookup_series(self, series: Series, publisher_id: int) -> Optional[MokkariSe
             else:
                 series_title = Prompt.ask("Series title", console=CONSOLE)
                 output = self._search_series(publisher_id, series_title)
+        self.memo.put_series(
+            Source.METRON, publisher_id, series.title, output, series.volume, series.start_year
+        )
         return output
 
     def update_publisher(self, result: MokkariPublisher, publisher: Publisher):
@@ -211,41 +337,49 @@ def update_publisher(self, result: MokkariPublisher, publisher: Publisher):
     def _select_publisher(self, publisher_id: int) -> Optional[MokkariPublisher]:
         CONSOLE.print(f"Getting Publisher: {publisher_id=}", style="logging.level.debug")
         try:
-            return self.session.publisher(publisher_id)
+            result = self.cache.fetch(self.session.publisher, publisher_id)
+            self.ids.link(
+                "publisher",
+                {Source.METRON: result.id, Source.COMICVINE: getattr(result, "cv_id", None)},
+            )
+            return result
         except ApiError:
             CONSOLE.print(
                 f"Unable to get Publisher: {publisher_id=}", style="logging.level.warning"
             )
         return None
 
-    def _search_publisher(self, title: str) -> Optional[MokkariPublisher]:
+    def _search_publisher(self, title: str, interactive: bool = True) -> Optional[MokkariPublisher]:
         CONSOLE.print(f"Searching for Publisher: {title=}", style="logging.level.debug")
         output = None
         try:
-            publisher_list = self.session.publishers_list({"name": title})
+            publisher_list = self.cache.fetch(self.session.publishers_list, {"name": title})
         except ApiError:
             publisher_list = []
-        if publisher_list := sorted(publisher_list, key=lambda p: p.name, alg=ns.NA | ns.G):
-            publisher_index = create_menu(
-                options=[f"{p.id} | {p.name}" for p in publisher_list],
-                prompt="Select Publisher",
-                default="None of the Above",
-            )
-            if publisher_index != 0:
-                output = self._select_publisher(publisher_list[publisher_index - 1].id)
+        if selected := self.scorer.select(
+            target={"title": title},
+            candidates=sorted(publisher_list, key=lambda p: p.name, alg=ns.NA | ns.G),
+            fields=lambda p: {"title": p.name},
+            describe=lambda p: f"{p.id} | {p.name}",
+            prompt="Select Publisher",
+            interactive=interactive,
+        ):
+            output = self._select_publisher(selected.id)
         return output
 
-    def lookup_publisher(self, publisher: Publisher) -> Optional[MokkariPublisher]:
+    def lookup_publisher(
+        self, publisher: Publisher, interactive: bool = True
+    ) -> Optional[MokkariPublisher]:
         output = None
-        source_list = [x.source for x in publisher.resources]
-        if Source.METRON in source_list:
-            index = source_list.index(Source.METRON)
-            output = self._select_publisher(publisher.resources[index].value)
+        if publisher_id := self.ids.resolve("publisher", publisher.resources, Source.METRON):
+            output = self._select_publisher(publisher_id)
+        if not output:
+            output = self.memo.get_publisher(Source.METRON, publisher.title)
         if not output:
-            output = self._search_publisher(publisher.title)
+            output = self._search_publisher(publisher.title, interactive=interactive)
         if not output and publisher.title.startswith("Marvel"):
-            output = self._search_publisher("Marvel")
-        while not output:
+            output = self._search_publisher("Marvel", interactive=interactive)
+        while not output and interactive:
             index = create_menu(
                 options=["Enter Publisher id", "Enter Publisher title"],
                 prompt="Select",
@@ -259,10 +393,46 @@ def lookup_publisher(self, publisher: Publisher) -> Optional[MokkariPublisher]:
             else:
                 publisher_title = Prompt.ask("Publisher title", console=CONSOLE)
                 output = self._search_publisher(publisher_title)
+        self.memo.put_publisher(Source.METRON, publisher.title, output)
         return output
 
+    def _lookup_known_issue(
+        self, metadata: Metadata
+    ) -> Optional[Tuple[MokkariPublisher, MokkariSeries, MokkariIssue]]:
+        if not (issue_id := self.ids.resolve("issue", metadata.issue.resources, Source.METRON)):
+            return None
+        if not (issue := self._select_issue(issue_id)):
+            return None
+        # Issues embed their publisher and series, the series details are only needed when the
+        # start year is still missing
+        series = issue.series
+        if not metadata.series.start_year and not getattr(series, "year_began", None):
+            series = self._select_series(series.id) or series
+        return issue.publisher, series, issue
+
+    def resolve_metadata(
+        self, metadata: Metadata
+    ) -> Optional[Tuple[MokkariPublisher, MokkariSeries, MokkariIssue]]:
+        if results := self._lookup_known_issue(metadata):
+            return results
+        if publisher := self.lookup_publisher(metadata.publisher, interactive=False):
+            if series := self.lookup_series(metadata.series, publisher.id, interactive=False):
+                if issue := self.lookup_issue(metadata.issue, series.id, interactive=False):
+                    return publisher, series, issue
+        return None
+
+    def apply_metadata(
+        self, results: Tuple[MokkariPublisher, MokkariSeries, MokkariIssue], metadata: Metadata
+    ):
+        publisher, series, issue = results
+        self.update_publisher(publisher, metadata.publisher)
+        self.update_series(series, metadata.series)
+        self.update_issue(issue, metadata.issue)
+
     def update_metadata(self, metadata: Metadata):
-        if publisher := self.lookup_publisher(metadata.publisher):
+        if results := self._lookup_known_issue(metadata):
+            self.apply_metadata(results, metadata)
+        elif publisher := self.lookup_publisher(metadata.publisher):
             self.update_publisher(publisher, metadata.publisher)
             if series := self.lookup_series(metadata.series, publisher.id):
                 self.update_series(series, metadata.series)
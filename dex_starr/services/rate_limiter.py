@@ -0,0 +1,151 @@
+__all__ = ["RateLimiter", "TokenBucket", "rate_limit_delay"]
+
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from threading import Lock, local
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dex_starr.console import CONSOLE
+
+RATE_LIMIT_STATUS = 429
+RETRY_LATER_STATUS = 503
+RATE_LIMIT_MESSAGE = re.compile(r"throttled|rate limit|too many requests|slow down", re.IGNORECASE)
+# Metron answers with "Request was throttled. Expected available in 37 seconds."
+RETRY_SECONDS = re.compile(r"(\d+) seconds?", re.IGNORECASE)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_delay(err: BaseException) -> Optional[float]:
+    """Seconds the service asked to wait, 0 when it didn't say or None if it wasn't rate limited.
+
+    The service clients wrap the requests errors, so the whole exception chain is checked for a
+    throttled response. A 503 only counts when it says when to retry, any other is an outage left
+    to the circuit breaker.
+    """
+    chain = []
+    while err and err not in chain:
+        chain.append(err)
+        err = err.__cause__ or err.__context__
+    for err in chain:
+        response = getattr(err, "response", None)
+        status = getattr(response, "status_code", None) if response is not None else None
+        if status == RATE_LIMIT_STATUS or (
+            status == RETRY_LATER_STATUS and "Retry-After" in response.headers
+        ):
+            return parse_retry_after(response.headers.get("Retry-After")) or 0.0
+    for err in chain:
+        if RATE_LIMIT_MESSAGE.search(str(err)):
+            match = RETRY_SECONDS.search(str(err))
+            return float(match.group(1)) if match else 0.0
+    return None
+
+
+class TokenBucket:
+    def __init__(self, calls: int, period: float):
+        self.capacity = calls
+        self.rate = calls / period
+        self.tokens = float(calls)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = Lock()
+
+    def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                delay = self.blocked_until - now
+                if delay <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def block(self, seconds: float):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class RateLimiter:
+    """Request budgets shared by everything talking to the same service.
+
+    acquire takes a token from every budget of the service before a request is made and call
+    retries anything the service rejected for exceeding its quota. The wait is whatever the
+    service asked for, otherwise an exponential backoff with full jitter, and holds back every
+    other request to that service as well.
+    """
+
+    def __init__(
+        self,
+        budgets: Dict[str, List[Tuple[int, float]]],
+        retries: int = 4,
+        backoff: float = 2.0,
+        max_backoff: float = 120.0,
+    ):
+        self.buckets = {
+            service: [TokenBucket(calls, period) for calls, period in limits]
+            for service, limits in budgets.items()
+        }
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.local = local()
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.rejected = 0
+        self.lock = Lock()
+
+    def acquire(self, service: Optional[str]):
+        self.local.service = service
+        waited = sum(x.acquire() for x in self.buckets.get(service, []))
+        if waited:
+            with self.lock:
+                self.throttled += 1
+                self.throttled_seconds += waited
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            self.local.service = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                delay = rate_limit_delay(err)
+                if delay is None or attempt >= self.retries:
+                    raise
+                if not delay:
+                    delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+                service = self.local.service
+                with self.lock:
+                    self.rejected += 1
+                CONSOLE.print(
+                    f"Rate limited by {service or 'service'}, retrying in {delay:.1f}s",
+                    style="logging.level.warning",
+                )
+                for bucket in self.buckets.get(service, []):
+                    bucket.block(delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def __str__(self):
+        return (
+            f"Rate limits: waited {self.throttled_seconds:.1f}s over {self.throttled} requests, "
+            f"{self.rejected} rejected by the services"
+        )
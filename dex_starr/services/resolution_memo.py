@@ -0,0 +1,112 @@
+__all__ = ["ResolutionMemo"]
+
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+from dex_starr.models.metadata.enums import Source
+
+PublisherKey = Tuple[Source, str]
+SeriesKey = Tuple[Source, Optional[int], str, Optional[int], Optional[int]]
+
+
+class ResolutionMemo:
+    """Publishers and series already resolved during this run.
+
+    Every archive of a series searches for the same publisher and series, so once one has been
+    resolved the later archives reuse the entity without asking the service or the user again.
+    A memo with a parent reads through to it but keeps what is put to itself, and the hits it
+    counted, until commit.
+    """
+
+    def __init__(self, parent: Optional["ResolutionMemo"] = None):
+        self.parent = parent
+        self.publishers: Dict[PublisherKey, Any] = {}
+        self.series: Dict[SeriesKey, Any] = {}
+        self.hits = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def publisher_key(service: Source, title: str) -> PublisherKey:
+        return service, title.casefold()
+
+    @staticmethod
+    def series_key(
+        service: Source,
+        publisher_id: Optional[int],
+        title: str,
+        volume: Optional[int] = None,
+        start_year: Optional[int] = None,
+    ) -> SeriesKey:
+        return service, publisher_id, title.casefold(), volume, start_year
+
+    def get_publisher(self, service: Source, title: str) -> Optional[Any]:
+        return self._get("publishers", self.publisher_key(service, title))
+
+    def put_publisher(self, service: Source, title: str, result: Optional[Any]):
+        if result is None:
+            return
+        with self.lock:
+            self.publishers[self.publisher_key(service, title)] = result
+
+    def get_series(
+        self,
+        service: Source,
+        publisher_id: Optional[int],
+        title: str,
+        volume: Optional[int] = None,
+        start_year: Optional[int] = None,
+    ) -> Optional[Any]:
+        return self._get(
+            "series", self.series_key(service, publisher_id, title, volume, start_year)
+        )
+
+    def put_series(
+        self,
+        service: Source,
+        publisher_id: Optional[int],
+        title: str,
+        result: Optional[Any],
+        volume: Optional[int] = None,
+        start_year: Optional[int] = None,
+    ):
+        if result is None:
+            return
+        with self.lock:
+            self.series[self.series_key(service, publisher_id, title, volume, start_year)] = result
+
+    def _get(self, entries: str, key: Tuple) -> Optional[Any]:
+        memo, output = self, None
+        while memo and output is None:
+            with memo.lock:
+                output = getattr(memo, entries).get(key)
+            memo = memo.parent
+        if output is not None:
+            with self.lock:
+                self.hits += 1
+        return output
+
+    def commit(self):
+        with self.lock:
+            publishers, series = self.publishers.copy(), self.series.copy()
+            self.publishers.clear()
+            self.series.clear()
+            hits, self.hits = self.hits, 0
+        with self.parent.lock:
+            self.parent.publishers.update(publishers)
+            self.parent.series.update(series)
+            self.parent.hits += hits
+
+    def clear(self, service: Optional[Source] = None):
+        with self.lock:
+            for entries in (self.publishers, self.series):
+                for key in [x for x in entries if service is None or x[0] == service]:
+                    del entries[key]
+
+    def __len__(self) -> int:
+        return len(self.publishers) + len(self.series)
+
+    def __str__(self):
+        return (
+            f"Resolution memo: {len(self.publishers)} publishers and {len(self.series)} series "
+            f"resolved, reused {self.hits} times"
+        )
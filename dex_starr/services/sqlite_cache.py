@@ -1,56 +1,594 @@
-__all__ = ["SQLiteCache"]
+__all__ = ["CACHE_KINDS", "MemoryCache", "SQLiteCache", "classify_query"]
 
 import json
+import re
 import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import date, timedelta
-from typing import Any, Dict, Optional
+from importlib import import_module
+from pathlib import Path
+from threading import Condition, Event, RLock, Thread, local
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type, Union
 
 from dex_starr import get_cache_root
+from dex_starr.console import CONSOLE
+from dex_starr.services.circuit_breaker import CircuitBreaker, ServiceUnavailable, is_outage
+from dex_starr.services.rate_limiter import RateLimiter, rate_limit_delay
+
+SCHEMA_VERSION = 2
+SWEEP_BATCH = 500
+EVICT_TARGET = 0.9
+NEVER_EXPIRES = date.max.isoformat()
+CACHE_KINDS = ["issue", "publisher", "search", "series"]
+NEGATIVE_KEY = "__negative__"
+# Only errors raised by the service clients are remembered, and raised again from the cache
+ERROR_MODULES = ["esak.exceptions", "himon.exceptions", "mokkari.exceptions", "simyan.exceptions"]
+# How the service clients word an unknown id or endpoint
+NOT_FOUND = re.compile(r"not found|unknown endpoint|(could ?n[o']t|unable to) find|\b404\b", re.I)
+# Matched in order against the cache keys the service clients build from their request urls
+QUERY_PATTERNS = [
+    (service, kind, re.compile(pattern))
+    for service, kind, pattern in [
+        (
+            "comicvine",
+            "search",
+            r"comicvine\.gamespot\.com/api/(issues|publishers|search|volumes)/",
+        ),
+        ("comicvine", "issue", r"comicvine\.gamespot\.com/api/issue/"),
+        ("comicvine", "publisher", r"comicvine\.gamespot\.com/api/publisher/"),
+        ("comicvine", "series", r"comicvine\.gamespot\.com/api/volume/"),
+        ("league_of_comic_geeks", "search", r"leagueofcomicgeeks\.com/api/search/"),
+        ("league_of_comic_geeks", "issue", r"leagueofcomicgeeks\.com/api/comic/"),
+        ("league_of_comic_geeks", "series", r"leagueofcomicgeeks\.com/api/series/"),
+        ("marvel", "search", r"gateway\.marvel\.com(:\d+)?/v1/public/(comics|series)(\?|$)"),
+        ("marvel", "issue", r"gateway\.marvel\.com(:\d+)?/v1/public/comics/\d+(\?|$)"),
+        ("marvel", "series", r"gateway\.marvel\.com(:\d+)?/v1/public/series/\d+(\?|$)"),
+        ("metron", "search", r"metron\.cloud/api/\w+/(\?|$)"),
+        ("metron", "issue", r"metron\.cloud/api/issue/\d+/"),
+        ("metron", "publisher", r"metron\.cloud/api/publisher/\d+/"),
+        ("metron", "series", r"metron\.cloud/api/series/\d+/"),
+        ("comicvine", None, r"comicvine\.gamespot\.com/"),
+        ("league_of_comic_geeks", None, r"leagueofcomicgeeks\.com/"),
+        ("marvel", None, r"gateway\.marvel\.com"),
+        ("metron", None, r"metron\.cloud/"),
+    ]
+]
+
+
+def classify_query(query: str) -> Tuple[Optional[str], Optional[str]]:
+    for service, kind, pattern in QUERY_PATTERNS:
+        if pattern.search(query):
+            return service, kind
+    return None, None
+
+
+def copy_response(response: Union[Dict[str, Any], List[Any]]) -> Union[Dict[str, Any], List[Any]]:
+    # The service clients extend the top level results list in place while paging, so each caller
+    # gets its own top level containers. Nested values are never modified and stay shared.
+    if isinstance(response, list):
+        return list(response)
+    return {k: list(v) if isinstance(v, list) else v for k, v in response.items()}
+
+
+def is_empty(response: Union[Dict[str, Any], List[Any]]) -> bool:
+    if isinstance(response, list):
+        return not response
+    if isinstance(response.get("data"), dict):
+        response = response["data"]
+    return "results" in response and not response["results"]
+
+
+class CachedList(list):
+    # The clients treat a falsy cached response as a miss, so a cached empty list has to read true
+    def __bool__(self) -> bool:
+        return True
+
+
+def is_negative(response: Union[Dict[str, Any], List[Any]]) -> bool:
+    return (isinstance(response, dict) and NEGATIVE_KEY in response) or is_empty(response)
+
+
+def is_not_found(err: Optional[BaseException]) -> bool:
+    # Responses that failed to parse or validate are bugs on this side, not answers to remember
+    seen = []
+    while err and err not in seen:
+        if isinstance(err, ValueError):
+            return False
+        response = getattr(err, "response", None)
+        if response is not None and getattr(response, "status_code", 0) == 404:
+            return True
+        seen.append(err)
+        err = err.__cause__ or err.__context__
+    return bool(seen and NOT_FOUND.search(str(seen[0])))
+
+
+def negative_error(entry: Dict[str, str]) -> Optional[Exception]:
+    module, _, name = entry.get("error", "").rpartition(".")
+    if module not in ERROR_MODULES:
+        return None
+    error = getattr(import_module(module), name, None)
+    if not isinstance(error, type) or not issubclass(error, Exception):
+        return None
+    return error(entry.get("message", ""))
+
+
+class MemoryCache:
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[Dict[str, Any], int, str]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = RLock()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str, today: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[2] > today:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy_response(entry[0])
+            self.misses += 1
+        return None
+
+    def put(self, key: str, response: Dict[str, Any], size: int, expiry: str):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = (copy_response(response), size, expiry)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def discard(self, key: str):
+        with self.lock:
+            if entry := self.entries.pop(key, None):
+                self.size -= entry[1]
+
+    def __str__(self):
+        return (
+            f"Memory cache: {self.hits} hits, {self.misses} misses ({self.hit_rate:.0%}), "
+            f"{len(self.entries)}/{self.max_entries} entries, "
+            f"{self.size // 1024}/{self.max_bytes // 1024} KiB"
+        )
 
 
 class SQLiteCache:
+    """Response cache shared by all the service talkers through a single locked connection.
+
+    Responses are stored zlib compressed. Expired rows are removed in small batches alongside
+    inserts and once the stored responses exceed max_size the least recently accessed rows are
+    evicted and the freed pages returned to the filesystem.
+
+    Each response expires after the number of days ttl sets for its service and kind, falling
+    back to expiry, and is still served for stale days afterwards. Service calls made through
+    fetch which were answered from a stale response are repeated in the background to refresh it.
+
+    With write_behind, inserts and access times are queued and written by a background thread on
+    a second connection, committing once flush_entries are queued or every flush_interval
+    seconds. Queued responses are served from memory until written and close flushes the rest.
+
+    Every miss is followed by a request from the service client, so that is where a token is
+    taken from the limiter's budget for the service, and fetch retries calls it rejected. It is
+    also where the breaker refuses requests to a service that keeps failing, cached responses are
+    still served while it does.
+
+    Lookups the service client reported as not found are remembered for negative days and the same
+    error is raised again from the cache until then. Empty results expire just as quickly, both
+    even when expiry is disabled.
+    """
+
     def __init__(
         self,
-        path: str = get_cache_root() / "cache.sqlite",
+        path: Path = get_cache_root() / "cache.sqlite",
         expiry: Optional[int] = 14,
+        memory: Optional[MemoryCache] = None,
+        max_size: int = 256 * 1024 * 1024,
+        compress: bool = True,
+        ttl: Optional[Dict[str, Dict[str, int]]] = None,
+        stale: int = 0,
+        write_behind: bool = False,
+        flush_entries: int = 100,
+        flush_interval: float = 5.0,
+        limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        negative: int = 1,
     ):
         self.expiry = expiry
-        self.con = sqlite3.connect(path)
-        self.cur = self.con.cursor()
-        self.cur.execute("CREATE TABLE IF NOT EXISTS queries (query, response, expiry);")
-        self.delete()
-
-    def select(self, query: str) -> Dict[str, Any]:
-        if self.expiry:
-            self.cur.execute(
-                "SELECT response FROM queries WHERE query = ? and expiry > ?;",
-                (query, date.today().isoformat()),
-            )
-        else:
-            self.cur.execute("SELECT response FROM queries WHERE query = ?;", (query,))
-        if results := self.cur.fetchone():
-            return json.loads(results[0])
-        return {}
+        self.ttl = ttl or {}
+        self.stale = stale
+        self.memory = memory
+        self.max_size = max_size
+        self.compress = compress
+        self.limiter = limiter
+        self.breaker = breaker
+        self.negative = negative
+        self.negatives = 0
+        self.lock = RLock()
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode = WAL;")
+        self.con.execute("PRAGMA synchronous = NORMAL;")
+        self.migrate()
+        self.sweep_pending = bool(self.expiry)
+        self.size = self.con.execute("SELECT COALESCE(SUM(size), 0) FROM queries;").fetchone()[0]
+        self.evicted = 0
+        self.local = local()
+        self.revalidator = ThreadPoolExecutor(max_workers=1, thread_name_prefix="revalidate")
+        self.revalidating = set()
+        self.revalidations: Set[Future] = set()
+        self.revalidated = 0
+        self.pending: Dict[str, Tuple[Union[bytes, str], str, float, int]] = {}
+        self.flushing: Dict[str, Tuple[Union[bytes, str], str, float, int]] = {}
+        self.touched: Dict[str, float] = {}
+        self.flush_entries = flush_entries
+        self.flush_interval = flush_interval
+        self.writer = self.con
+        self.write_lock = self.lock
+        self.writer_thread = None
+        if write_behind:
+            self.writer = sqlite3.connect(path, check_same_thread=False)
+            self.writer.execute("PRAGMA synchronous = NORMAL;")
+            self.write_lock = RLock()
+            self.condition = Condition(self.lock)
+            self.closing = Event()
+            self.writer_thread = Thread(target=self._write_behind, name="cache-writer", daemon=True)
+            self.writer_thread.start()
+
+    def migrate(self):
+        with self.lock:
+            version = self.con.execute("PRAGMA user_version;").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            # Only applies to a new database, existing ones are converted by the VACUUM below
+            self.con.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            try:
+                self.con.execute("BEGIN;")
+                if version < 1:
+                    self.con.execute(
+                        "CREATE TABLE IF NOT EXISTS queries (query, response, expiry);"
+                    )
+                    self.con.execute("ALTER TABLE queries RENAME TO queries_old;")
+                    self.con.execute(
+                        "CREATE TABLE queries ("
+                        "query TEXT PRIMARY KEY, response TEXT NOT NULL, expiry TEXT NOT NULL"
+                        ");"
+                    )
+                    self.con.execute("CREATE INDEX queries_expiry ON queries (expiry);")
+                    # Keep the newest of any duplicated rows left behind by the old append-only
+                    # table
+                    self.con.execute(
+                        "INSERT INTO queries (query, response, expiry) "
+                        "SELECT query, response, MAX(expiry) FROM queries_old "
+                        "WHERE query IS NOT NULL AND response IS NOT NULL GROUP BY query;"
+                    )
+                    self.con.execute("DROP TABLE queries_old;")
+                if version < 2:
+                    # Existing rows keep their plain json text and are compressed when next
+                    # replaced, both forms are understood by decode
+                    self.con.execute(
+                        "ALTER TABLE queries ADD COLUMN accessed REAL NOT NULL DEFAULT 0;"
+                    )
+                    self.con.execute(
+                        "ALTER TABLE queries ADD COLUMN size INTEGER NOT NULL DEFAULT 0;"
+                    )
+                    self.con.execute("UPDATE queries SET size = length(CAST(response AS BLOB));")
+                    self.con.execute("CREATE INDEX queries_accessed ON queries (accessed);")
+                self.con.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+                self.con.commit()
+            except sqlite3.Error:
+                self.con.rollback()
+                raise
+            if self.con.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+                self.con.execute("VACUUM;")
+
+    def encode(self, content: str) -> Union[bytes, str]:
+        if self.compress:
+            return zlib.compress(content.encode("UTF-8"))
+        return content
+
+    @staticmethod
+    def decode(value: Union[bytes, str]) -> str:
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode("UTF-8")
+        return value
+
+    def lifetime(self, query: str) -> Optional[int]:
+        service, kind = classify_query(query)
+        return self.ttl.get(service, {}).get(kind, self.expiry)
+
+    def cutoff(self) -> str:
+        # Rows expiring on or before this are too old to be served even as stale
+        return (date.today() - timedelta(days=self.stale)).isoformat()
+
+    def select(self, query: str) -> Optional[Union[Dict[str, Any], List[Any]]]:
+        if getattr(self.local, "bypass", False):
+            return self.miss(query)
+        today = date.today().isoformat()
+        # Negative entries always expire on their own date, the rest only when expiry is enabled
+        valid_after = today if self.expiry else ""
+        if self.memory and (response := self.memory.get(query, valid_after)) is not None:
+            with self.lock:
+                self.touched[query] = time.time()
+            return self.answer(query, response)
+        with self.lock:
+            if entry := self.pending.get(query) or self.flushing.get(query):
+                results = entry[:2]
+            else:
+                results = self.con.execute(
+                    "SELECT response, expiry FROM queries WHERE query = ? AND expiry > ?;",
+                    (query, self.cutoff() if self.expiry else ""),
+                ).fetchone()
+            if results:
+                self.touched[query] = time.time()
+        if not results:
+            return self.miss(query)
+        content = self.decode(results[0])
+        response = json.loads(content)
+        negative = is_negative(response)
+        if negative and results[1] <= today:
+            return self.miss(query)
+        if results[1] <= valid_after:
+            self.local.stale = True
+        elif self.memory and not negative:
+            self.memory.put(query, response, len(content), results[1])
+        return self.answer(query, response)
+
+    def answer(
+        self, query: str, response: Union[Dict[str, Any], List[Any]]
+    ) -> Optional[Union[Dict[str, Any], List[Any]]]:
+        if isinstance(response, dict) and NEGATIVE_KEY in response:
+            if err := negative_error(response[NEGATIVE_KEY]):
+                self.negatives += 1
+                raise err
+            return self.miss(query)
+        if isinstance(response, list) and not response:
+            self.negatives += 1
+            return CachedList()
+        return response
+
+    def miss(self, query: str) -> None:
+        self.local.query = query
+        self.local.service = service = classify_query(query)[0]
+        if self.breaker:
+            self.breaker.check(service)
+        if self.limiter:
+            self.limiter.acquire(service)
+        return None
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        self.local.query = None
+        self.local.service = None
+        try:
+            if self.limiter:
+                output = self.limiter.call(func, *args, **kwargs)
+            else:
+                output = func(*args, **kwargs)
+        except ServiceUnavailable:
+            raise
+        except Exception as err:
+            service = self.local.service
+            if self.breaker and service and is_outage(err):
+                self.breaker.failure(service, err)
+                raise ServiceUnavailable(service, str(err)) from err
+            if (
+                self.negative
+                and self.local.query
+                and type(err).__module__ in ERROR_MODULES
+                and not is_outage(err)
+                and rate_limit_delay(err) is None
+                and is_not_found(err)
+            ):
+                error = {
+                    "error": f"{type(err).__module__}.{type(err).__name__}",
+                    "message": str(err),
+                }
+                self.insert(self.local.query, {NEGATIVE_KEY: error}, days=self.negative)
+            raise
+        if self.breaker and self.local.service:
+            self.breaker.success(self.local.service)
+        return output
 
     def get(self, key: str) -> Optional[Dict[str, Any]]:
-        return self.select(query=key) or None
+        return self.select(query=key)
 
-    def insert(self, query: str, response: str):
-        if self.expiry:
-            expiry = date.today() + timedelta(days=self.expiry)
+    def insert(self, query: str, response: str, days: Optional[int] = None):
+        if not days:
+            days = self.negative if self.negative and is_empty(response) else self.lifetime(query)
+        if days:
+            expiry = (date.today() + timedelta(days=days)).isoformat()
         else:
-            expiry = date.today()
-        self.cur.execute(
-            "INSERT INTO queries (query, response, expiry) VALUES (?, ?, ?);",
-            (query, json.dumps(response), expiry.isoformat()),
-        )
-        self.con.commit()
+            expiry = NEVER_EXPIRES
+        content = json.dumps(response)
+        value = self.encode(content)
+        entry = (value, expiry, time.time(), len(value))
+        if self.writer_thread:
+            with self.lock:
+                self.pending[query] = entry
+                if len(self.pending) >= self.flush_entries:
+                    self.condition.notify()
+        else:
+            with self.lock:
+                touched, self.touched = self.touched, {}
+                self._write({query: entry}, touched)
+        if self.memory and not is_negative(response):
+            self.memory.put(query, response, len(content), expiry)
 
     def store(self, key: str, value: str):
         return self.insert(query=key, response=value)
 
-    def delete(self):
-        if not self.expiry:
+    def fetch(self, func: Callable, *args, **kwargs) -> Any:
+        self.local.stale = False
+        output = self.call(func, *args, **kwargs)
+        if self.local.stale and self.stale:
+            key = (func.__qualname__, repr(args), repr(kwargs))
+            with self.lock:
+                if key not in self.revalidating:
+                    self.revalidating.add(key)
+                    future = self.revalidator.submit(self._revalidate, key, func, *args, **kwargs)
+                    self.revalidations.add(future)
+                    future.add_done_callback(self.revalidations.discard)
+        return output
+
+    def fetch_each(
+        self, func: Callable, arguments: List[Tuple], ignore: Tuple[Type[Exception], ...] = ()
+    ) -> Iterator[Tuple[int, Any]]:
+        """Fetches every set of arguments at once, yielding the index and output as each completes.
+
+        Calls failing with one of the ignored errors are left out. Closing the generator early
+        cancels the calls that haven't started, those already running still finish into the cache.
+        """
+        pool = ThreadPoolExecutor(max_workers=max(len(arguments), 1), thread_name_prefix="fetch")
+        futures = {pool.submit(self.fetch, func, *x): i for i, x in enumerate(arguments)}
+        try:
+            for future in as_completed(futures):
+                try:
+                    output = future.result()
+                except ignore:
+                    continue
+                yield futures[future], output
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def _revalidate(self, key: Tuple[str, str, str], func: Callable, *args, **kwargs):
+        self.local.bypass = True
+        try:
+            self.call(func, *args, **kwargs)
+            self.revalidated += 1
+        except Exception as err:
+            CONSOLE.print(
+                f"Unable to refresh stale cache entry: {key[0]}{key[1]} - {err}",
+                style="logging.level.warning",
+            )
+        finally:
+            self.local.bypass = False
+            with self.lock:
+                self.revalidating.discard(key)
+
+    def _write_behind(self):
+        while not self.closing.is_set():
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: len(self.pending) >= self.flush_entries or self.closing.is_set(),
+                    timeout=self.flush_interval,
+                )
+            try:
+                self.flush()
+            except sqlite3.Error as err:
+                CONSOLE.print(f"Unable to write to cache: {err}", style="logging.level.warning")
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                self.flushing, self.pending = self.pending, {}
+                touched, self.touched = self.touched, {}
+            try:
+                if self.flushing or touched:
+                    self._write(self.flushing, touched)
+            finally:
+                with self.lock:
+                    self.flushing = {}
+
+    def _write(
+        self,
+        entries: Dict[str, Tuple[Union[bytes, str], str, float, int]],
+        touched: Dict[str, float],
+    ):
+        with self.write_lock:
+            for query, (value, expiry, accessed, size) in entries.items():
+                previous = self.writer.execute(
+                    "SELECT size FROM queries WHERE query = ?;", (query,)
+                ).fetchone()
+                self.writer.execute(
+                    "INSERT OR REPLACE INTO queries (query, response, expiry, accessed, size) "
+                    "VALUES (?, ?, ?, ?, ?);",
+                    (query, value, expiry, accessed, size),
+                )
+                self.size += size - (previous[0] if previous else 0)
+            self.writer.executemany(
+                "UPDATE queries SET accessed = ? WHERE query = ?;",
+                [(accessed, query) for query, accessed in touched.items()],
+            )
+            self.sweep()
+            self.evict()
+            self.writer.commit()
+
+    def _delete_rows(self, rows: List[Tuple[int, int]]):
+        self.writer.executemany("DELETE FROM queries WHERE rowid = ?;", [(x[0],) for x in rows])
+        self.size -= sum(x[1] for x in rows)
+
+    def sweep(self):
+        if not self.sweep_pending:
+            return
+        with self.write_lock:
+            rows = self.writer.execute(
+                "SELECT rowid, size FROM queries WHERE expiry <= ? LIMIT ?;",
+                (self.cutoff(), SWEEP_BATCH),
+            ).fetchall()
+            self._delete_rows(rows)
+            self.sweep_pending = len(rows) >= SWEEP_BATCH
+
+    def evict(self):
+        if not self.max_size or self.size <= self.max_size:
             return
-        self.cur.execute("DELETE FROM queries WHERE expiry < ?;", (date.today().isoformat(),))
-        self.con.commit()
+        # Evict below the cap so the next few inserts don't each trigger another pass
+        target = int(self.max_size * EVICT_TARGET)
+        with self.write_lock:
+            while self.size > target:
+                rows = self.writer.execute(
+                    "SELECT rowid, size FROM queries ORDER BY accessed LIMIT ?;", (SWEEP_BATCH,)
+                ).fetchall()
+                if not rows:
+                    break
+                excess = self.size - target
+                for index, (_, size) in enumerate(rows):
+                    excess -= size
+                    if excess <= 0:
+                        rows = rows[: index + 1]
+                        break
+                self._delete_rows(rows)
+                self.evicted += len(rows)
+            self.compact()
+
+    def compact(self):
+        # The pragma frees a single page per step, executescript runs it to completion but commits
+        # any open transaction first
+        with self.write_lock:
+            self.writer.executescript("PRAGMA incremental_vacuum;")
+
+    def close(self):
+        # Refreshes that haven't started are dropped, shutdown only waits on the running one
+        for future in list(self.revalidations):
+            future.cancel()
+        self.revalidator.shutdown(wait=True)
+        if self.writer_thread:
+            self.closing.set()
+            with self.condition:
+                self.condition.notify()
+            self.writer_thread.join()
+        self.flush()
+        with self.write_lock:
+            self.compact()
+            self.writer.close()
+        with self.lock:
+            if self.writer is not self.con:
+                self.con.close()
+
+    def __str__(self):
+        return (
+            f"SQLite cache: {self.size // 1024}/{self.max_size // 1024} KiB stored, "
+            f"{self.evicted} evicted, {self.revalidated} refreshed, "
+            f"{self.negatives} known failures answered"
+        )
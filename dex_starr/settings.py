@@ -1,18 +1,22 @@
 __all__ = [
     "Settings",
     "GeneralSettings",
+    "CacheSettings",
     "ComicvineSettings",
+    "ExpirySettings",
     "LeagueOfComicGeeksSettings",
     "MarvelSettings",
     "MetronSettings",
+    "RateLimitSettings",
 ]
 
 from pathlib import Path
-from typing import ClassVar, List
+from typing import ClassVar, Dict, List
 
 from pydantic import BaseModel, Extra, Field, validator
 
 from dex_starr import get_config_root
+from dex_starr.compression import COMPRESSION_POLICIES, SEVEN_FILTERS
 
 try:
     import tomllib as tomlreader  # Python >= 3.11
@@ -29,41 +33,120 @@ class Config:
         extra = Extra.ignore
 
 
+class RateLimitSettings(SettingsModel):
+    calls: int = Field(ge=1)
+    period: int = Field(ge=1)
+
+
 class MetronSettings(SettingsModel):
+    failure_cooldown: int = Field(default=300, ge=0)
+    failure_threshold: int = Field(default=3, ge=1)
     generate_metroninfo_file: bool = True
     password: str = ""
+    rate_limits: List[RateLimitSettings] = [
+        RateLimitSettings(calls=25, period=60),
+        RateLimitSettings(calls=10000, period=24 * 60 * 60),
+    ]
     username: str = ""
 
 
 class MarvelSettings(SettingsModel):
+    failure_cooldown: int = Field(default=300, ge=0)
+    failure_threshold: int = Field(default=3, ge=1)
     public_key: str = ""
     private_key: str = ""
+    rate_limits: List[RateLimitSettings] = [RateLimitSettings(calls=3000, period=24 * 60 * 60)]
 
 
 class LeagueOfComicGeeksSettings(SettingsModel):
     client_id: str = ""
     client_secret: str = ""
     access_token: str = ""
+    failure_cooldown: int = Field(default=300, ge=0)
+    failure_threshold: int = Field(default=3, ge=1)
+    rate_limits: List[RateLimitSettings] = [RateLimitSettings(calls=20, period=60)]
+    timeout: int = Field(default=30, ge=1)
 
 
 class ComicvineSettings(SettingsModel):
     api_key: str = ""
+    failure_cooldown: int = Field(default=300, ge=0)
+    failure_threshold: int = Field(default=3, ge=1)
+    rate_limits: List[RateLimitSettings] = [
+        RateLimitSettings(calls=20, period=60),
+        RateLimitSettings(calls=200, period=60 * 60),
+    ]
+    timeout: int = Field(default=30, ge=1)
+
+
+class ExpirySettings(SettingsModel):
+    issue: int = Field(default=14, ge=0)
+    publisher: int = Field(default=365, ge=0)
+    search: int = Field(default=1, ge=0)
+    series: int = Field(default=180, ge=0)
+
+
+class CacheSettings(SettingsModel):
+    comicvine: ExpirySettings = ExpirySettings()
+    compress: bool = True
+    expiry: int = Field(default=14, ge=0)
+    flush_entries: int = Field(default=100, ge=1)
+    flush_interval: float = Field(default=5.0, gt=0)
+    league_of_comic_geeks: ExpirySettings = ExpirySettings()
+    marvel: ExpirySettings = ExpirySettings()
+    max_size: int = Field(default=256 * 1024 * 1024, ge=0)
+    memory_bytes: int = Field(default=64 * 1024 * 1024, ge=0)
+    memory_entries: int = Field(default=2048, ge=0)
+    metron: ExpirySettings = ExpirySettings()
+    negative: int = Field(default=1, ge=0)
+    stale: int = Field(default=7, ge=0)
+    write_behind: bool = True
+
+    @property
+    def ttl(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "comicvine": self.comicvine.dict(),
+            "league_of_comic_geeks": self.league_of_comic_geeks.dict(),
+            "marvel": self.marvel.dict(),
+            "metron": self.metron.dict(),
+        }
 
 
 class GeneralSettings(SettingsModel):
     collection_folder: Path = Path.home() / "comics" / "collection"
+    compression_level: int = Field(default=6, ge=0, le=9)
+    compression_policy: str = "adaptive"
+    compression_workers: int = Field(default=1, ge=1)
+    filename_threshold: float = Field(default=0.75, ge=0, le=1)
+    import_disk_limit: int = Field(default=4096, ge=0)
     import_folder: Path = Path.home() / "comics" / "import"
     generate_comicinfo_file: bool = True
     generate_metadata_file: bool = True
+    import_workers: int = Field(default=1, ge=1)
+    match_threshold: float = Field(default=0.9, ge=0, le=1)
     output_format: str = "cbz"
     resolution_order: List[str] = Field(default_factory=list)
+    seven_filter: str = "lzma2"
+    streaming_repack: bool = False
 
     @validator("output_format", pre=True)
     def validate_output_format(cls, v):
-        if v in ["cbz", "cb7"]:
+        if v in ["cbz", "cb7", "cbt"]:
             return v
         raise NotImplementedError(f"Unsupported output format: {v}")
 
+    @validator("compression_policy", pre=True)
+    def validate_compression_policy(cls, v):
+        if v in COMPRESSION_POLICIES:
+            return v
+        raise NotImplementedError(f"Unsupported compression policy: {v}")
+
+    @validator("seven_filter", pre=True)
+    def validate_seven_filter(cls, v):
+        if v in SEVEN_FILTERS:
+            return v
+        raise NotImplementedError(f"Unsupported 7z filter: {v}")
+
 
 class Settings(SettingsModel):
     FILENAME: ClassVar[str] = get_config_root() / "settings.toml"
@@ -76,6 +159,7 @@ class Settings(SettingsModel):
             "Comicvine",
         ]
     )
+    cache: CacheSettings = CacheSettings()
     comicvine: ComicvineSettings = ComicvineSettings()
     league_of_comic_geeks: LeagueOfComicGeeksSettings = LeagueOfComicGeeksSettings()
     marvel: MarvelSettings = MarvelSettings()
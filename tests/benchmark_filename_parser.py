@@ -0,0 +1,153 @@
+"""Time the filename parser over a corpus of filenames and report how sure it is of them.
+
+Pass a text file with one path per line, relative to the import folder, e.g. the output of
+`find . -name "*.cb?"` run from it, or a json file of paths with the expected answers. Without one
+the real-world names in files/Filenames.json are used, along with distinct variants of them with
+the series, number, volume and year swapped out, so the accuracy can be reported as well.
+
+Every name is parsed once by a fresh parser with the regex and title caches emptied, then again,
+so the cold and warm throughput are reported separately.
+"""
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from statistics import mean, median
+from typing import Any, Dict, List, Optional, Tuple
+
+from dex_starr import setup_logging
+from dex_starr.filename_parser import FilenameParser, ParsedName
+from dex_starr.services.match_scorer import normalize_title, title_similarity
+
+ROOT = Path("/import")
+CORPUS_FILE = Path(__file__).parent / "files" / "Filenames.json"
+VARIANTS = 20_000
+YEAR = re.compile(r"\(((?:19|20)\d{2})\)")
+VOLUME = re.compile(r"\b(v|Vol\. )(\d+)\b")
+COLLECTED = re.compile(r"\b(TPB|HC|GN)\b")
+Expected = Optional[Tuple[str, str, int, str]]
+
+
+def read_corpus(corpus_file: Path) -> List[Dict[str, Any]]:
+    with corpus_file.open("r", encoding="UTF-8") as stream:
+        if corpus_file.suffix == ".json":
+            return json.load(stream)
+        return [{"path": x.strip()} for x in stream if x.strip()]
+
+
+def vary(entry: Dict[str, Any], titles: List[str], rng: random.Random) -> Dict[str, Any]:
+    entry = dict(entry)
+    folder, _, name = entry["path"].rpartition("/")
+    title = rng.choice(titles)
+    for old, new in [
+        (entry["series"], title),
+        (entry["series"].replace(" ", "_"), title.replace(" ", "_")),
+    ]:
+        if old in entry["path"]:
+            folder, name = folder.replace(old, new), name.replace(old, new)
+            entry["series"] = title
+            break
+    name = YEAR.sub(lambda x: f"({rng.randint(1960, 2023)})", name)
+    if match := VOLUME.search(name):
+        volume = rng.randint(1, 12)
+        name = f"{name[:match.start(2)]}{volume}{name[match.end(2):]}"
+        # Collected editions are numbered by their volume
+        if COLLECTED.search(name) and entry["number"] == match.group(2):
+            entry["number"] = str(volume)
+        else:
+            entry["volume"] = volume
+    if entry["number"].isdigit():
+        pattern = rf"(?<=[#\s_])0*{entry['number']}(?=\s*(\(|\.\w+$))"
+        if matches := list(re.finditer(pattern, name)):
+            match, number = matches[-1], rng.randint(1, 200)
+            padded = str(number).zfill(len(match.group(0)))
+            name = f"{name[:match.start()]}{padded}{name[match.end():]}"
+            entry["number"] = str(number)
+    entry["path"] = f"{folder}/{name}" if folder else name
+    return entry
+
+
+def generate_variants(corpus: List[Dict[str, Any]], size: int) -> List[Dict[str, Any]]:
+    rng = random.Random(0)
+    # Titles ending in a number need the folder to tell them apart, so aren't swapped in
+    titles = sorted({x["series"] for x in corpus if not x["series"][-1].isdigit()})
+    known = {x["path"] for x in corpus}
+    output = {}
+    for _ in range(size * 10):
+        entry = vary(rng.choice(corpus), titles, rng)
+        if entry["path"] not in known:
+            output.setdefault(entry["path"], entry)
+        if len(output) >= size:
+            break
+    return list(output.values())
+
+
+def expected(entry: Dict[str, Any]) -> Expected:
+    if "series" not in entry:
+        return None
+    return entry["publisher"], entry["series"].casefold(), entry["volume"], entry["number"]
+
+
+def actual(result: ParsedName) -> Expected:
+    return (
+        result.metadata.publisher.title,
+        result.metadata.series.title.casefold(),
+        result.metadata.series.volume,
+        result.metadata.issue.number,
+    )
+
+
+def timed(files: List[Path], parser: FilenameParser) -> Tuple[List[ParsedName], float]:
+    start = time.perf_counter()
+    results = [parser.parse(x) for x in files]
+    return results, time.perf_counter() - start
+
+
+def report(label: str, entries: List[Dict[str, Any]], results: List[ParsedName], show: int):
+    scores = [x.score for x in results]
+    print(
+        f"{label}: {len(entries)} names, score mean {mean(scores):.2f}, median {median(scores):.2f}"
+    )
+    for threshold in [0.5, 0.75, 0.9]:
+        confident = sum(x >= threshold for x in scores)
+        print(f"  Scored at least {threshold:.0%}: {confident / len(scores):.1%}")
+    if not all(expected(x) for x in entries):
+        return
+    wrong = [(x, y) for x, y in zip(entries, results) if actual(y) != expected(x)]
+    print(f"  Correct: {1 - len(wrong) / len(entries):.1%}")
+    for entry, result in wrong[:show]:
+        print(f"    {entry['path']} -> {result}")
+    if len(wrong) > show:
+        print(f"    ... and {len(wrong) - show} more")
+
+
+def main():
+    setup_logging()
+    if len(sys.argv) > 1:
+        groups = [("Corpus", read_corpus(Path(sys.argv[1])))]
+    else:
+        corpus = read_corpus(CORPUS_FILE)
+        groups = [("Real names", corpus), ("Variants", generate_variants(corpus, VARIANTS))]
+    entries = [x for _, group in groups for x in group]
+    files = [ROOT / x["path"] for x in entries]
+
+    re.purge()
+    normalize_title.cache_clear()
+    title_similarity.cache_clear()
+    parser = FilenameParser(root=ROOT)
+    results, cold = timed(files, parser)
+    _, warm = timed(files, parser)
+    print(f"Parsed {len(files)} distinct names")
+    print(f"  Cold: {cold:.2f}s, {len(files) / cold:,.0f} per second")
+    print(f"  Warm: {warm:.2f}s, {len(files) / warm:,.0f} per second")
+
+    start = 0
+    for label, group in groups:
+        report(label, group, results[start : start + len(group)], show=20)
+        start += len(group)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Run the rate limiter and circuit breaker against a local server standing in for the services.
+
+Requests go through SQLiteCache the same way the service clients make them, with the server's
+answer picked by the path: /ok/ answers, /throttled/ is rate limited once, /busy/ is unavailable
+once but says when to retry, /down/ fails with a 502 and /unavailable/ with a 503.
+"""
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+import requests
+
+from dex_starr.services.circuit_breaker import CircuitBreaker, ServiceUnavailable
+from dex_starr.services.rate_limiter import RateLimiter, TokenBucket
+from dex_starr.services.sqlite_cache import SQLiteCache
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        status, headers = 200, {}
+        if "/down/" in self.path:
+            status = 502
+        elif "/unavailable/" in self.path:
+            status = 503
+        elif "/busy/" in self.path and self.requests.count(self.path) == 1:
+            status, headers = 503, {"Retry-After": "1"}
+        elif "/throttled/" in self.path and self.requests.count(self.path) == 1:
+            status, headers = 429, {"Retry-After": "1"}
+        data = json.dumps({"error": "OK", "results": {"path": self.path}}).encode("UTF-8")
+        self.send_response(status)
+        for key, value in {**headers, "Content-Length": str(len(data))}.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    ServiceHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ServiceHandler)
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/comicvine.gamespot.com/api"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(cache: SQLiteCache, url: str):
+    def request():
+        if (cached := cache.get(url)) is not None:
+            return cached
+        response = requests.get(url, timeout=5)
+        response.raise_for_status()
+        cache.insert(url, response.json())
+        return response.json()
+
+    return cache.fetch(request)
+
+
+def test_bucket_refill():
+    bucket = TokenBucket(calls=2, period=0.4)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    start = time.monotonic()
+    assert bucket.acquire() > 0
+    assert 0.15 <= time.monotonic() - start < 0.5
+    time.sleep(0.4)
+    start = time.monotonic()
+    bucket.acquire()
+    bucket.acquire()
+    assert time.monotonic() - start < 0.1
+
+
+def test_limiter_budget(server, tmp_path):
+    limiter = RateLimiter({"comicvine": [(3, 0.6)]})
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", limiter=limiter)
+    try:
+        start = time.monotonic()
+        for index in range(5):
+            fetch(cache, f"{server}/issue/4000-{index}/")
+        assert time.monotonic() - start >= 0.3
+        assert limiter.throttled == 2
+        # Cached responses take nothing from the budget
+        start = time.monotonic()
+        for index in range(5):
+            fetch(cache, f"{server}/issue/4000-{index}/")
+        assert time.monotonic() - start < 0.2
+        assert len(ServiceHandler.requests) == 5
+    finally:
+        cache.close()
+
+
+def test_limiter_retry_after(server, tmp_path):
+    limiter = RateLimiter({"comicvine": [(10, 1)]})
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", limiter=limiter)
+    try:
+        start = time.monotonic()
+        response = fetch(cache, f"{server}/issue/throttled/")
+        assert time.monotonic() - start >= 1.0
+        assert response["results"]["path"].endswith("/throttled/")
+        assert limiter.rejected == 1
+        assert len(ServiceHandler.requests) == 2
+        # The wait holds back every other request to the service as well
+        assert limiter.buckets["comicvine"][0].blocked_until > 0
+    finally:
+        cache.close()
+
+
+def test_limiter_retries_busy(server, tmp_path):
+    limiter = RateLimiter({"comicvine": [(10, 1)]})
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", limiter=limiter)
+    try:
+        start = time.monotonic()
+        fetch(cache, f"{server}/issue/busy/")
+        assert time.monotonic() - start >= 1.0
+        assert limiter.rejected == 1
+        assert len(ServiceHandler.requests) == 2
+    finally:
+        cache.close()
+
+
+def test_unavailable_goes_to_breaker(server, tmp_path):
+    limiter = RateLimiter({"comicvine": [(10, 1)]})
+    breaker = CircuitBreaker({"comicvine": (2, 60)})
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", limiter=limiter, breaker=breaker)
+    try:
+        # Without a Retry-After it is an outage, not a rate limit to back off from
+        start = time.monotonic()
+        for index in range(2):
+            with pytest.raises(ServiceUnavailable):
+                fetch(cache, f"{server}/issue/unavailable/{index}/")
+        assert time.monotonic() - start < 1.0
+        assert limiter.rejected == 0
+        assert len(ServiceHandler.requests) == 2
+        assert breaker.tripped["comicvine"] == 1
+    finally:
+        cache.close()
+
+
+def test_limiter_gives_up(server, tmp_path):
+    limiter = RateLimiter({"comicvine": [(10, 1)]}, retries=0)
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", limiter=limiter)
+    try:
+        with pytest.raises(requests.HTTPError):
+            fetch(cache, f"{server}/issue/throttled/")
+        assert len(ServiceHandler.requests) == 1
+    finally:
+        cache.close()
+
+
+def test_breaker_transitions(server, tmp_path):
+    breaker = CircuitBreaker({"comicvine": (2, 0.5)})
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", breaker=breaker)
+    try:
+        fetch(cache, f"{server}/issue/ok/")
+        # Closed, each outage still reaches the service
+        for index in range(2):
+            with pytest.raises(ServiceUnavailable):
+                fetch(cache, f"{server}/issue/down/{index}/")
+        assert len(ServiceHandler.requests) == 3
+        assert breaker.tripped["comicvine"] == 1
+
+        # Open, requests are refused without reaching the service but cached ones are served
+        with pytest.raises(ServiceUnavailable):
+            fetch(cache, f"{server}/issue/down/2/")
+        assert fetch(cache, f"{server}/issue/ok/")["results"]["path"].endswith("/ok/")
+        assert len(ServiceHandler.requests) == 3
+        assert breaker.skipped["comicvine"] == 1
+
+        # Half open, a single failure opens it again
+        time.sleep(0.6)
+        with pytest.raises(ServiceUnavailable):
+            fetch(cache, f"{server}/issue/down/3/")
+        assert len(ServiceHandler.requests) == 4
+        assert breaker.tripped["comicvine"] == 2
+        with pytest.raises(ServiceUnavailable):
+            fetch(cache, f"{server}/issue/down/4/")
+        assert len(ServiceHandler.requests) == 4
+
+        # Half open, a success closes it
+        time.sleep(0.6)
+        fetch(cache, f"{server}/issue/ok/2/")
+        assert "comicvine" not in breaker.failures
+        assert "comicvine" not in breaker.opened
+        with pytest.raises(ServiceUnavailable):
+            fetch(cache, f"{server}/issue/down/5/")
+        assert len(ServiceHandler.requests) == 6
+        assert breaker.tripped["comicvine"] == 2
+    finally:
+        cache.close()
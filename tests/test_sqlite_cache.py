@@ -0,0 +1,48 @@
+"""Check which responses the cache evicts once it grows past its size cap."""
+from dex_starr.services.sqlite_cache import MemoryCache, SQLiteCache
+
+URL = "https://comicvine.gamespot.com/api/issue/4000-{}/"
+
+
+def response(index: int):
+    return {"error": "OK", "results": {"id": index, "name": "x" * 1000}}
+
+
+def stored(cache: SQLiteCache):
+    return {x[0] for x in cache.con.execute("SELECT query FROM queries;").fetchall()}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", compress=False)
+    try:
+        for index in range(10):
+            cache.insert(URL.format(index), response(index))
+        cache.max_size = cache.size + cache.size // 10
+        assert cache.get(URL.format(0))
+        for index in range(10, 13):
+            cache.insert(URL.format(index), response(index))
+        assert cache.evicted
+        assert URL.format(0) in stored(cache)
+        assert URL.format(1) not in stored(cache)
+    finally:
+        cache.close()
+
+
+def test_evicts_least_recently_used_with_memory(tmp_path):
+    memory = MemoryCache()
+    cache = SQLiteCache(path=tmp_path / "cache.sqlite", compress=False, memory=memory)
+    try:
+        for index in range(10):
+            cache.insert(URL.format(index), response(index))
+        cache.max_size = cache.size + cache.size // 10
+        # Served from memory, it still counts as used for the rows on disk
+        for _ in range(30):
+            assert cache.get(URL.format(0))
+        assert memory.hits == 30
+        for index in range(10, 13):
+            cache.insert(URL.format(index), response(index))
+        assert cache.evicted
+        assert URL.format(0) in stored(cache)
+        assert URL.format(1) not in stored(cache)
+    finally:
+        cache.close()